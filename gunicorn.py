@@ -15,6 +15,7 @@
 
 """Configure the gunicorn server."""
 
+import gc
 import os
 
 import gevent.monkey
@@ -44,9 +45,33 @@ if _config == "production":
     # workers I/O bound and a third processing a request will utilize available
     # resources well, but that guess needs to be tested and benchmarked.
     workers = 3
-    preload_app = True
+    # Workers loading the data in the background start serving sooner, and
+    # share its memory through a packed data store instead.
+    preload_app = (
+        os.environ.get("DATA_LOADING_BACKGROUND", "false").lower() != "true"
+    )
 else:
     # FIXME: The number of workers is up for debate. At least for testing more
     # than one worker could make sense.
     workers = 1
     reload = True
+
+
+def pre_fork(server, worker):
+    """Finish loading, and keep the collector from copying loaded objects."""
+    from metanetx import parser
+
+    # Threads don't survive forking, so a preloaded app must finish loading.
+    parser.wait_until_loaded()
+    # With `preload_app`, collections in the workers would otherwise write to
+    # every object loaded before forking, copying all of their memory pages.
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    """Fork the search processes once the worker has loaded the app."""
+    from metanetx import parser, pool
+
+    pool.start()
+    # Gunicorn resets the signal handlers of the app preloaded by the master.
+    parser.reload_on_signal()
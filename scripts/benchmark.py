@@ -0,0 +1,504 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark the MetaNetX API internals.
+
+Run from the repository root, e.g.:
+
+    python scripts/benchmark.py startup
+    python scripts/benchmark.py lazy --accessed 1000
+    python scripts/benchmark.py reaction-search "pyruvate kinase" ATP
+    python scripts/benchmark.py cooperative "pyruvate kinase"
+    python scripts/benchmark.py concurrency glucose ATP kinase --processes 4
+    python scripts/benchmark.py metabolite-search glucose glucsoe
+    python scripts/benchmark.py memory
+    python scripts/benchmark.py render --batch 500
+    ENVIRONMENT=development python scripts/benchmark.py bulk-lookup
+    python scripts/benchmark.py normalize --batch 500
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import Flask, jsonify
+
+from metanetx import data, lazy, parser, pool, render, search
+from metanetx.cache import LRUCache
+from metanetx.data import (
+    BaseMetabolite,
+    BaseReaction,
+    Compartment,
+    Metabolite,
+    Reaction,
+)
+from metanetx.index import Deadline
+from metanetx.schemas import (
+    NormalizedReactionResponseSchema,
+    ReactionResponseSchema,
+)
+
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def startup(args):
+    """Compare loading the data from the source files and from a snapshot."""
+    for processes in (1, args.processes):
+        _, duration = _timed(parser.load_metanetx_data, processes=processes)
+        print(
+            f"Parsed the source files in {duration:.2f}s using {processes} "
+            "processes"
+        )
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "snapshot.pickle")
+        _, duration = _timed(parser.write_snapshot, path)
+        size = os.path.getsize(path) / 2 ** 20
+        print(f"Wrote a {size:.0f} MiB snapshot in {duration:.2f}s")
+        _, duration = _timed(parser.load_metanetx_data, snapshot=path)
+        print(
+            f"Restored {len(data.reactions)} reactions and "
+            f"{len(data.metabolites)} metabolites in {duration:.2f}s"
+        )
+
+
+def lazy_startup(args):
+    """Compare loading the data eagerly and lazily on time and memory."""
+    print(
+        f"{'mode':<6} {'load':>8} {'resident':>10} {'peak':>10} "
+        f"{'access':>8}"
+    )
+    for mode in ("eager", "lazy"):
+        # Fresh interpreters, so that the memory of one mode doesn't linger in
+        # the other.
+        with ProcessPoolExecutor(
+            1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            load, resident, peak, access = executor.submit(
+                _load_and_access, mode == "lazy", args.accessed
+            ).result()
+        print(
+            f"{mode:<6} {load:>7.2f}s {resident:>6.0f} MiB {peak:>6.0f} MiB "
+            f"{access:>7.3f}s"
+        )
+
+
+def _load_and_access(lazy_, accessed):
+    """Load the data, and access the annotations of random objects."""
+    logging.disable(logging.INFO)
+    _, load = _timed(parser.load_metanetx_data, lazy=lazy_)
+    with open("/proc/self/statm") as file_:
+        resident = int(file_.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 2 ** 10
+    lazy.materialized.maxsize = accessed
+    random.seed(0)
+    reactions = random.sample(list(data.reactions.values()), accessed)
+    metabolites = random.sample(list(data.metabolites.values()), accessed)
+    _, access = _timed(
+        lambda: [
+            (reaction.annotation, reaction.with_references())
+            for reaction in reactions
+        ]
+        + [metabolite.annotation for metabolite in metabolites]
+    )
+    return load, resident / 2 ** 20, peak / 2 ** 20, access
+
+
+def reaction_search(args):
+    """Compare the reaction search engines on speed and result overlap."""
+    parser.load_metanetx_data()
+    engines = [e for e in search.ENGINES if e != "scan"]
+    print(f"{'query':<30} {'scan':>8}" + "".join(f" {e:>17}" for e in engines))
+    for query in args.queries:
+        (expected, _), scan_time = _timed(
+            search.search_reactions, query, args.limit, engine="scan"
+        )
+        line = f"{query:<30} {scan_time:>7.3f}s"
+        for engine in engines:
+            (results, _), duration = _timed(
+                search.search_reactions,
+                query,
+                args.limit,
+                engine=engine,
+                shortlist=args.shortlist,
+            )
+            overlap = len(set(expected) & set(results))
+            line += f" {duration:>7.3f}s {overlap:>4}/{len(expected):<4}"
+        print(line)
+
+
+def cooperative(args):
+    """Measure how long reaction searches delay other greenlets."""
+    import gevent
+    import gevent.monkey
+
+    gevent.monkey.patch_time()
+    parser.load_metanetx_data()
+    print(
+        f"{'query':<20} {'deadline':<9} {'search':>8} {'p99 delay':>10} "
+        f"{'max delay':>10}"
+    )
+    for query in args.queries:
+        for budget in (None, args.budget):
+            delays = []
+            prober = gevent.spawn(_probe, delays)
+            gevent.sleep(0.01)
+            deadline = None if budget is None else Deadline(budget)
+            _, duration = _timed(
+                search.search_reactions,
+                query,
+                args.limit,
+                engine=args.engine,
+                deadline=deadline,
+            )
+            # Let the probe record the delay of the last health check.
+            gevent.sleep(0.01)
+            prober.kill()
+            delays.sort()
+            p99 = delays[int(len(delays) * 0.99)] if delays else 0
+            label = "none" if budget is None else f"{budget}s"
+            print(
+                f"{query:<20} {label:<9} {duration:>7.3f}s "
+                f"{p99 * 1000:>8.1f}ms {delays[-1] * 1000:>8.1f}ms"
+            )
+
+
+def concurrency(args):
+    """Compare concurrent reaction searches in the worker and in a pool."""
+    import gevent
+    import gevent.monkey
+
+    # The search pool waits on sockets and queues, which need to cooperate.
+    gevent.monkey.patch_all()
+    parser.load_metanetx_data()
+    print(
+        f"{'scoring':<20} {'searches':>8} {'duration':>9} {'p99 delay':>10} "
+        f"{'max delay':>10}"
+    )
+    for processes in (0, args.processes):
+        pool.pool = pool.SearchPool(processes) if processes else None
+        pool.start()
+        delays = []
+        prober = gevent.spawn(_probe, delays)
+        gevent.sleep(0.01)
+        start = time.perf_counter()
+        gevent.joinall(
+            [
+                gevent.spawn(
+                    pool.run,
+                    search.rank_reactions,
+                    query,
+                    args.limit,
+                    engine=args.engine,
+                )
+                for query in args.queries
+            ]
+        )
+        duration = time.perf_counter() - start
+        gevent.sleep(0.01)
+        prober.kill()
+        if pool.pool:
+            pool.pool.close()
+        delays.sort()
+        label = f"{processes} processes" if processes else "in the worker"
+        print(
+            f"{label:<20} {len(args.queries):>8} {duration:>8.3f}s "
+            f"{delays[int(len(delays) * 0.99)] * 1000:>8.1f}ms "
+            f"{delays[-1] * 1000:>8.1f}ms"
+        )
+
+
+def _probe(delays, interval=0.001):
+    """Sleep like a health check every millisecond, recording how late."""
+    import gevent
+
+    while True:
+        start = time.perf_counter()
+        gevent.sleep(interval)
+        delays.append(time.perf_counter() - start - interval)
+
+
+def metabolite_search(args):
+    """Compare the substring and fuzzy metabolite searches with a scan."""
+    parser.load_metanetx_data()
+    for query in args.queries:
+        print(f"{query}:")
+        for mode in ("scan", "substring", "fuzzy"):
+            if mode == "scan":
+                (metabolites, total), duration = _timed(
+                    _scan_metabolites, query, args.limit
+                )
+            else:
+                (metabolites, total), duration = _timed(
+                    search.search_metabolites,
+                    query,
+                    args.limit,
+                    mode=mode,
+                    deadline=Deadline(args.budget),
+                )
+            names = ", ".join(m.name for m in metabolites[:5])
+            print(f"  {mode:<10} {duration:>7.3f}s {total:>7} matches: {names}")
+
+
+def _scan_metabolites(query, limit):
+    """Match every metabolite, as the substring search did before its index."""
+    metabolites = [m for m in data.metabolites.values() if m.match(query)]
+    return metabolites[:limit], len(metabolites)
+
+
+class _DictObject:
+    """The former representation of the data classes, for comparison."""
+
+    def __init__(self, obj):
+        for slot in obj.__slots__:
+            if not slot.startswith("_"):
+                setattr(self, slot, getattr(obj, slot))
+        if isinstance(obj, BaseReaction):
+            self.equation_parsed = Reaction.parse_equation(obj.equation_string)
+        self.annotation = defaultdict(
+            list, {ns: list(ids) for ns, ids in obj.annotation.items()}
+        )
+
+
+def _compact_object(obj):
+    if isinstance(obj, BaseReaction):
+        copy = Reaction(obj.mnx_id, obj.name, obj.equation_string, obj.ec)
+    elif isinstance(obj, BaseMetabolite):
+        copy = Metabolite(obj.mnx_id, obj.name, obj.formula)
+    else:
+        copy = Compartment(obj.mnx_id, obj.name, obj.xref)
+    copy.annotation = {ns: list(ids) for ns, ids in obj.annotation.items()}
+    return copy
+
+
+def _allocated(function, objects):
+    """Return the bytes allocated per object by copying it with a function."""
+    tracemalloc.start()
+    copies = [function(obj) for obj in objects]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / len(copies)
+
+
+def memory(args):
+    """Compare the memory used by the former and compact data classes."""
+    parser.load_metanetx_data()
+    print(f"{'objects':<14} {'count':>8} {'before':>10} {'after':>10}")
+    for name in ("compartments", "reactions", "metabolites"):
+        objects = list(getattr(data, name).values())
+        before = _allocated(_DictObject, objects)
+        after = _allocated(_compact_object, objects)
+        print(f"{name:<14} {len(objects):>8} {before:>8.0f} B {after:>8.0f} B")
+
+
+def render_reactions(args):
+    """Compare marshalling a reaction batch with joining rendered fragments."""
+    parser.load_metanetx_data()
+    mnx_ids = list(data.reactions)[: args.batch]
+    schema = ReactionResponseSchema(many=True)
+    render.fragments.maxsize = len(mnx_ids)
+    with Flask(__name__).app_context():
+        _, duration = _timed(
+            lambda: jsonify(
+                schema.dump(
+                    [data.reactions[m].with_references() for m in mnx_ids]
+                )
+            )
+        )
+        print(f"Marshalled {len(mnx_ids)} reactions in {duration:.3f}s")
+        for state in ("cold", "warm"):
+            _, duration = _timed(render.reactions_response, mnx_ids)
+            print(f"Rendered them from {state} fragments in {duration:.3f}s")
+
+
+def bulk_lookup(args):
+    """Compare the throughput of GET and POST reaction batches."""
+    from metanetx.app import app, init_app
+
+    init_app(app)
+    logging.disable(logging.INFO)
+    keys = list(data.reaction_key_index)
+    random.seed(0)
+    identifiers = [random.choice(keys) for _ in range(args.identifiers)]
+    body = json.dumps({"query": identifiers}).encode()
+    with app.test_client() as client:
+
+        def get():
+            for start in range(0, len(identifiers), args.batch):
+                query = ",".join(identifiers[start : start + args.batch])
+                client.get("/reactions/batch", query_string={"query": query})
+
+        def post(data, headers):
+            client.post(
+                "/reactions/batch",
+                data=data,
+                content_type="application/json",
+                headers=headers,
+            )
+
+        # Render the fragments first, to only compare the request overhead.
+        post(body, {})
+        for method, function, function_args in (
+            (f"GET in batches of {args.batch}", get, ()),
+            ("POST", post, (body, {})),
+            (
+                "POST gzip",
+                post,
+                (gzip.compress(body), {"Content-Encoding": "gzip"}),
+            ),
+        ):
+            _, duration = _timed(function, *function_args)
+            print(
+                f"{method:<24} {len(identifiers) / duration:>9.0f} "
+                "identifiers/s"
+            )
+
+
+def normalize(args):
+    """Compare embedded and normalized reaction batch responses."""
+    parser.load_metanetx_data()
+    random.seed(0)
+    mnx_ids = random.sample(list(data.reactions), args.batch)
+    reactions = [data.reactions[m] for m in mnx_ids]
+
+    def marshal_embedded():
+        return jsonify(
+            ReactionResponseSchema(many=True).dump(
+                [r.with_references() for r in reactions]
+            )
+        )
+
+    def marshal_normalized():
+        references = [r.with_references() for r in reactions]
+        return jsonify(
+            NormalizedReactionResponseSchema().dump(
+                {
+                    "reactions": reactions,
+                    "metabolites": {
+                        m.mnx_id: m
+                        for r in references
+                        for m in r["metabolites"]
+                    },
+                    "compartments": {
+                        c.mnx_id: c
+                        for r in references
+                        for c in r["compartments"]
+                    },
+                }
+            )
+        )
+
+    print(f"{'response':<12} {'size':>10} {'marshalled':>11} {'rendered':>9}")
+    with Flask(__name__).app_context():
+        for name, marshal, respond in (
+            ("embedded", marshal_embedded, render.reactions_response),
+            (
+                "normalized",
+                marshal_normalized,
+                render.normalized_reactions_response,
+            ),
+        ):
+            _, marshal_time = _timed(marshal)
+            # Render from scratch, without any memoized fragments.
+            render.fragments = LRUCache(0)
+            response, render_time = _timed(respond, mnx_ids)
+            print(
+                f"{name:<12} {len(response.data) / 1024:>7.0f} KiB "
+                f"{marshal_time:>10.3f}s {render_time:>8.3f}s"
+            )
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = argument_parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    subparser = subparsers.add_parser("startup", help=startup.__doc__)
+    subparser.add_argument("--processes", type=int, default=3)
+    subparser.set_defaults(function=startup)
+
+    subparser = subparsers.add_parser("lazy", help=lazy_startup.__doc__)
+    subparser.add_argument("--accessed", type=int, default=1000)
+    subparser.set_defaults(function=lazy_startup)
+
+    subparser = subparsers.add_parser(
+        "reaction-search", help=reaction_search.__doc__
+    )
+    subparser.add_argument("queries", nargs="+")
+    subparser.add_argument("--limit", type=int, default=30)
+    subparser.add_argument("--shortlist", type=int, default=2000)
+    subparser.set_defaults(function=reaction_search)
+
+    subparser = subparsers.add_parser("cooperative", help=cooperative.__doc__)
+    subparser.add_argument("queries", nargs="+")
+    subparser.add_argument("--limit", type=int, default=200)
+    subparser.add_argument("--engine", default="scan", choices=search.ENGINES)
+    subparser.add_argument("--budget", type=float, default=0.5)
+    subparser.set_defaults(function=cooperative)
+
+    subparser = subparsers.add_parser("concurrency", help=concurrency.__doc__)
+    subparser.add_argument("queries", nargs="+")
+    subparser.add_argument("--limit", type=int, default=200)
+    subparser.add_argument("--engine", default="scan", choices=search.ENGINES)
+    subparser.add_argument("--processes", type=int, default=4)
+    subparser.set_defaults(function=concurrency)
+
+    subparser = subparsers.add_parser(
+        "metabolite-search", help=metabolite_search.__doc__
+    )
+    subparser.add_argument("queries", nargs="+")
+    subparser.add_argument("--limit", type=int, default=30)
+    subparser.add_argument("--budget", type=float, default=0.1)
+    subparser.set_defaults(function=metabolite_search)
+
+    subparser = subparsers.add_parser("memory", help=memory.__doc__)
+    subparser.set_defaults(function=memory)
+
+    subparser = subparsers.add_parser("render", help=render_reactions.__doc__)
+    subparser.add_argument("--batch", type=int, default=500)
+    subparser.set_defaults(function=render_reactions)
+
+    subparser = subparsers.add_parser("bulk-lookup", help=bulk_lookup.__doc__)
+    subparser.add_argument("--identifiers", type=int, default=20000)
+    subparser.add_argument("--batch", type=int, default=100)
+    subparser.set_defaults(function=bulk_lookup)
+
+    subparser = subparsers.add_parser("normalize", help=normalize.__doc__)
+    subparser.add_argument("--batch", type=int, default=500)
+    subparser.set_defaults(function=normalize)
+
+    args = argument_parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
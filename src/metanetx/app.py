@@ -31,7 +31,16 @@ logger = logging.getLogger(__name__)
 def init_app(application):
     """Initialize the main app with config information and routes."""
     # Import local modules here to avoid circular dependencies.
-    from metanetx import errorhandlers, parser, resources
+    from metanetx import (
+        cache,
+        errorhandlers,
+        lazy,
+        parser,
+        pool,
+        render,
+        resources,
+    )
+    from metanetx.middleware import GzipRequest
     from metanetx.settings import current_config
 
     application.config.from_object(current_config())
@@ -51,8 +60,25 @@ def init_app(application):
     # Add routes and resources.
     resources.init_app(application)
 
-    # Add CORS information for all resources.
-    CORS(application)
+    # Create the search result, rendered fragment and lazily parsed object
+    # caches, and configure the search pool.
+    cache.init_app(application)
+    render.init_app(application)
+    lazy.init_app(application)
+    pool.init_app(application)
+
+    # Add CORS information for all resources, allowing browsers to read the
+    # pagination, partial and truncated search and dataset version headers.
+    CORS(
+        application,
+        expose_headers=[
+            "X-Total-Count",
+            "X-Next-Cursor",
+            "X-Search-Partial",
+            "X-Search-Truncated",
+            "X-Dataset-Version",
+        ],
+    )
 
     # Register error handlers
     errorhandlers.init_app(application)
@@ -64,7 +90,30 @@ def init_app(application):
     # via https.
     application.wsgi_app = ProxyFix(application.wsgi_app)
 
+    # Limit the size of request bodies, and decompress gzip-encoded batches.
+    application.wsgi_app = GzipRequest(
+        application.wsgi_app, application.config["MAX_REQUEST_BODY_SIZE"]
+    )
+
     # Read the metanetx source files into memory
-    parser.load_metanetx_data()
+    options = {
+        "snapshot": application.config["DATA_SNAPSHOT"],
+        "processes": application.config["DATA_LOADING_PROCESSES"],
+        "store": application.config["DATA_STORE"],
+        "lazy": application.config["DATA_LOADING_LAZY"],
+        "sidecar_directory": application.config["LAZY_SIDECAR_DIRECTORY"],
+    }
+    if application.config["DATA_LOADING_BACKGROUND"]:
+        # The search processes are forked before serving requests, which
+        # would be before the data is loaded.
+        if application.config["SEARCH_PROCESSES"]:
+            raise ValueError(
+                "The search pool requires loading the data in the foreground."
+            )
+        parser.start_loading(**options)
+    else:
+        parser.load_metanetx_data(**options)
+    # Load new releases of the source files without restarting.
+    parser.reload_on_signal()
 
     logger.info("Initialization complete")
@@ -0,0 +1,402 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cache search results, which are immutable once the data is loaded."""
+
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from . import data
+
+
+# Returned by `LRUCache.get` for keys which aren't cached, since `None` is a
+# valid result to cache.
+MISSING = object()
+
+# The result caches of the API resources, keyed by resource name.
+caches = {}
+# The computations in flight per resource, keyed by resource name.
+flights = {}
+
+
+def init_app(app):
+    """Create the result caches of the API resources."""
+    for name in (
+        "reactions",
+        "reactions_batch",
+        "metabolites",
+        "metabolites_batch",
+    ):
+        if app.config["SEARCH_CACHE_BACKEND"] == "shared":
+            caches[name] = SharedCache(
+                os.path.join(
+                    app.config["SEARCH_CACHE_DIRECTORY"],
+                    f"metanetx-{name}.cache",
+                ),
+                app.config["SEARCH_CACHE_SIZE"],
+            )
+        elif app.config["SEARCH_CACHE_BACKEND"] == "local":
+            caches[name] = LRUCache(app.config["SEARCH_CACHE_SIZE"])
+        else:
+            raise ValueError(
+                f"Unknown cache backend '{app.config['SEARCH_CACHE_BACKEND']}'"
+            )
+        flights[name] = SingleFlight()
+
+
+def cached(name, key, compute, keep=None):
+    """
+    Return the result for the given key, computing it unless it's cached.
+
+    Parameters
+    ----------
+    name : string
+        The name of the cache to use.
+    key : hashable
+        The normalized query, which is cached along with the version of the
+        current dataset.
+    compute : callable
+        Computes the result of the query. Results, including empty ones, are
+        cached and must not be mutated. Results are limited to what JSON can
+        represent, and tuples are returned as lists by the shared cache.
+    keep : callable, optional
+        Returns whether to cache a computed result, such as not the partial
+        results of a search that ran out of time. All results are cached by
+        default.
+
+    """
+    # Results are only valid for the dataset they were computed from.
+    key = (data.current().version, key)
+    cache = caches[name]
+    result = cache.get(key)
+    if result is MISSING:
+
+        def compute_and_cache():
+            result = compute()
+            if keep is None or keep(result):
+                cache.set(key, result)
+            return result
+
+        # Identical queries arriving while the result is computed wait for it,
+        # rather than computing it again.
+        result = flights[name].run(key, compute_and_cache)
+    return result
+
+
+def stats():
+    """Return the statistics of all result caches."""
+    return {name: cache.stats() for name, cache in caches.items()}
+
+
+def flight_stats():
+    """Return the number of computed and coalesced queries per resource."""
+    return {name: flight.stats() for name, flight in flights.items()}
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent computations of the same key.
+
+    The first caller computes the result, and callers arriving with the same
+    key before it's done wait for it and share the result, or the exception.
+    A computation interrupted by anything other than an `Exception`, such as
+    its greenlet being killed or timed out, isn't shared; the waiting callers
+    compute the result anew instead, one of them leading again. Under gevent,
+    the threading primitives are patched to switch greenlets.
+    """
+
+    def __init__(self):
+        self.computed = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def run(self, key, compute):
+        """Return the computed result for the key, computing it only once."""
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = self._flights[key] = _Flight()
+                    break
+                self.coalesced += 1
+            flight.done.wait()
+            if not flight.abandoned:
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result
+            with self._lock:
+                self.coalesced -= 1
+        try:
+            flight.result = compute()
+        except Exception as error:
+            flight.error = error
+            raise
+        except BaseException:
+            flight.abandoned = True
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                self.computed += 1
+            flight.done.set()
+        return flight.result
+
+    def stats(self):
+        return {
+            "in_flight": len(self._flights),
+            "computed": self.computed,
+            "coalesced": self.coalesced,
+        }
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "abandoned")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+
+class LRUCache:
+    """
+    Size-bounded cache evicting the least recently used entries.
+
+    Counts hits, misses and evictions, in order to tune its size. A size of 0
+    disables the cache.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached value for the key, or `MISSING`."""
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SharedCache:
+    """
+    Size-bounded cache shared by all processes on a host.
+
+    Entries are stored in a memory-mapped file, ideally on a tmpfs like
+    `/dev/shm`, so that all gunicorn workers share the cached results without
+    any outside service. The file is a set-associative table: a key hashes to
+    a set of `ways` fixed-size slots, and a full set evicts its least recently
+    used entry. Keys and values are stored as JSON, and values which don't fit
+    into a slot aren't cached.
+
+    Every set is guarded by a POSIX record lock on its byte range, against
+    other processes, and a lock against other threads or greenlets of this
+    process. Locks are only held while copying an entry, so blocking the gevent
+    hub on them is negligible. Hit, miss and eviction counts are kept per set
+    and summed up by `stats`.
+    """
+
+    MAGIC = b"MNXCACHE"
+    # Magic, version, number of sets, ways per set and slot size.
+    HEADER = struct.Struct("<8sIIII")
+    # Hits, misses and evictions.
+    SET_HEADER = struct.Struct("<QQQ")
+    # Key hash, last use, key length and value length.
+    SLOT_HEADER = struct.Struct("<QdII")
+    VERSION = 1
+
+    def __init__(self, path, maxsize, ways=8, slot_size=4096):
+        self.path = path
+        self.maxsize = maxsize
+        self.ways = ways
+        self.slot_size = slot_size
+        self.sets = max(1, -(-maxsize // ways))
+        self._set_size = self.SET_HEADER.size + ways * slot_size
+        self._lock = threading.Lock()
+        size = self.HEADER.size + self.sets * self._set_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        header = self.HEADER.pack(
+            self.MAGIC, self.VERSION, self.sets, ways, slot_size
+        )
+        # Initialize the file unless another process already did, with the
+        # same layout.
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self.HEADER.size, 0)
+        try:
+            if os.pread(self._fd, self.HEADER.size, 0) != header:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, header, 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.HEADER.size, 0)
+        self._map = mmap.mmap(self._fd, size)
+
+    def __len__(self):
+        return sum(
+            1
+            for index in range(self.sets)
+            for way in range(self.ways)
+            if self._slot(index, way)[2]
+        )
+
+    @contextmanager
+    def _locked(self, index):
+        offset = self._set_offset(index)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self._set_size, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self._set_size, offset)
+
+    def _set_offset(self, index):
+        return self.HEADER.size + index * self._set_size
+
+    def _slot_offset(self, index, way):
+        return (
+            self._set_offset(index)
+            + self.SET_HEADER.size
+            + way * self.slot_size
+        )
+
+    def _slot(self, index, way):
+        return self.SLOT_HEADER.unpack_from(
+            self._map, self._slot_offset(index, way)
+        )
+
+    def _count(self, index, hits=0, misses=0, evictions=0):
+        offset = self._set_offset(index)
+        counts = self.SET_HEADER.unpack_from(self._map, offset)
+        self.SET_HEADER.pack_into(
+            self._map,
+            offset,
+            counts[0] + hits,
+            counts[1] + misses,
+            counts[2] + evictions,
+        )
+
+    def _locate(self, key):
+        key = json.dumps(key, separators=(",", ":")).encode()
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        key_hash = int.from_bytes(digest, "little")
+        return key, key_hash, key_hash % self.sets
+
+    def _find(self, index, key, key_hash):
+        """Return the way holding the key in a locked set, or None."""
+        for way in range(self.ways):
+            slot_hash, _, key_length, _ = self._slot(index, way)
+            if slot_hash == key_hash and key_length == len(key):
+                start = self._slot_offset(index, way) + self.SLOT_HEADER.size
+                if self._map[start : start + key_length] == key:
+                    return way
+        return None
+
+    def get(self, key):
+        """Return the cached value for the key, or `MISSING`."""
+        key, key_hash, index = self._locate(key)
+        with self._locked(index):
+            way = self._find(index, key, key_hash)
+            if way is None:
+                self._count(index, misses=1)
+                return MISSING
+            offset = self._slot_offset(index, way)
+            _, _, key_length, value_length = self._slot(index, way)
+            self.SLOT_HEADER.pack_into(
+                self._map,
+                offset,
+                key_hash,
+                time.time(),
+                key_length,
+                value_length,
+            )
+            start = offset + self.SLOT_HEADER.size + key_length
+            value = self._map[start : start + value_length]
+            self._count(index, hits=1)
+        return json.loads(value)
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        key, key_hash, index = self._locate(key)
+        value = json.dumps(value, separators=(",", ":")).encode()
+        if self.SLOT_HEADER.size + len(key) + len(value) > self.slot_size:
+            return
+        with self._locked(index):
+            way = self._find(index, key, key_hash)
+            if way is None:
+                # Prefer an empty slot, otherwise the least recently used.
+                slots = [self._slot(index, way) for way in range(self.ways)]
+                way = min(
+                    range(self.ways),
+                    key=lambda way: (slots[way][2] > 0, slots[way][1]),
+                )
+                if slots[way][2]:
+                    self._count(index, evictions=1)
+            offset = self._slot_offset(index, way)
+            self.SLOT_HEADER.pack_into(
+                self._map, offset, key_hash, time.time(), len(key), len(value)
+            )
+            start = offset + self.SLOT_HEADER.size
+            self._map[start : start + len(key) + len(value)] = key + value
+
+    def stats(self):
+        counts = [
+            self.SET_HEADER.unpack_from(self._map, self._set_offset(index))
+            for index in range(self.sets)
+        ]
+        return {
+            "size": len(self),
+            "maxsize": self.sets * self.ways,
+            "hits": sum(count[0] for count in counts),
+            "misses": sum(count[1] for count in counts),
+            "evictions": sum(count[2] for count in counts),
+        }
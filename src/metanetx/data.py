@@ -17,32 +17,67 @@
 
 import logging
 import re
-from collections import defaultdict
+import sys
+from array import array
 
 from fuzzywuzzy import fuzz
+from werkzeug.local import Local, release_local
+
+from .index import DeletionIndex, NgramIndex, ScoreTable, SubstringIndex
 
 
 logger = logging.getLogger(__name__)
 
 
-class Compartment:
+class _Annotated:
+    __slots__ = ()
+
+    def annotate(self, namespace, identifier):
+        """Add a cross-reference to the annotation of this object."""
+        self.annotation.setdefault(namespace, []).append(identifier)
+
+
+class BaseCompartment(_Annotated):
+    """Compartment behavior, without storage for its attributes."""
+
+    __slots__ = ()
+
+
+class Compartment(BaseCompartment):
+    __slots__ = ("mnx_id", "name", "xref", "annotation")
+
     def __init__(self, mnx_id, name, xref):
-        self.mnx_id = mnx_id
+        self.mnx_id = sys.intern(mnx_id)
         self.name = name
         self.xref = xref
-        self.annotation = defaultdict(list)
+        self.annotation = {}
+
+
+class BaseReaction(_Annotated):
+    """
+    Reaction behavior, without storage for its attributes.
 
+    Subclasses provide `mnx_id`, `name`, `equation_string`, `ec`, `annotation`,
+    and the compact equation as `_species` and `_coefficients`.
+    """
+
+    __slots__ = ()
 
-class Reaction:
     metabolite_regex = re.compile(r"^([\d\.]+) (\w+)@(\w+)$")
 
-    def __init__(self, mnx_id, name, equation_string, ec):
-        self.mnx_id = mnx_id
-        self.name = name
-        self.equation_string = equation_string
-        self.equation_parsed = Reaction.parse_equation(self.equation_string)
-        self.ec = ec
-        self.annotation = defaultdict(list)
+    @property
+    def equation_parsed(self):
+        """Return the parsed equation, see `parse_equation`."""
+        return [
+            {
+                "metabolite_id": metabolite_id,
+                "compartment_id": compartment_id,
+                "coefficient": coefficient,
+            }
+            for metabolite_id, compartment_id, coefficient in zip(
+                self._species[::2], self._species[1::2], self._coefficients
+            )
+        ]
 
     def match(self, query):
         """
@@ -76,14 +111,34 @@ class Reaction:
             "metabolites": List of referred metabolite objects
             "compartments": List of referred compartments
         """
-        metabolite_ids = set(m["metabolite_id"] for m in self.equation_parsed)
-        compartment_ids = set(m["compartment_id"] for m in self.equation_parsed)
+        metabolite_ids, compartment_ids = self.references()
+        dataset = current()
         return {
             "reaction": self,
-            "metabolites": [metabolites[m] for m in metabolite_ids],
-            "compartments": [compartments[m] for m in compartment_ids],
+            "metabolites": [dataset.metabolites[m] for m in metabolite_ids],
+            "compartments": [dataset.compartments[m] for m in compartment_ids],
         }
 
+    def references(self):
+        """Return the sets of metabolite and compartment IDs in the equation."""
+        return set(self._species[::2]), set(self._species[1::2])
+
+    @staticmethod
+    def compact_equation(equation_string):
+        """
+        Parse the equation string into its compact form.
+
+        Returns a flat tuple of alternating metabolite and compartment IDs, and
+        an array of the coefficients, see `parse_equation`.
+        """
+        equation = BaseReaction.parse_equation(equation_string)
+        species = tuple(
+            sys.intern(m[key])
+            for m in equation
+            for key in ("metabolite_id", "compartment_id")
+        )
+        return species, array("d", (m["coefficient"] for m in equation))
+
     @staticmethod
     def parse_equation(equation_string):
         """
@@ -100,7 +155,7 @@ class Reaction:
         equation = []
         substrates, products = equation_string.split(" = ")
         for substrate in substrates.split(" + "):
-            match = re.match(Reaction.metabolite_regex, substrate)
+            match = re.match(BaseReaction.metabolite_regex, substrate)
             if not match:
                 raise ValueError(f"Invalid metabolite format: {substrate}")
             coefficient, metabolite_id, compartment_id = match.groups()
@@ -112,7 +167,7 @@ class Reaction:
                 }
             )
         for product in products.split(" + "):
-            match = re.match(Reaction.metabolite_regex, product)
+            match = re.match(BaseReaction.metabolite_regex, product)
             if not match:
                 raise ValueError(f"Invalid metabolite format: {product}")
             coefficient, metabolite_id, compartment_id = match.groups()
@@ -126,12 +181,34 @@ class Reaction:
         return equation
 
 
-class Metabolite:
-    def __init__(self, mnx_id, name, formula):
+class Reaction(BaseReaction):
+    # The parsed equation is stored compactly as a flat tuple of alternating
+    # metabolite and compartment IDs, and an array of the coefficients.
+    __slots__ = (
+        "mnx_id",
+        "name",
+        "equation_string",
+        "_species",
+        "_coefficients",
+        "ec",
+        "annotation",
+    )
+
+    def __init__(self, mnx_id, name, equation_string, ec):
         self.mnx_id = mnx_id
         self.name = name
-        self.formula = formula
-        self.annotation = defaultdict(list)
+        self.equation_string = equation_string
+        self._species, self._coefficients = Reaction.compact_equation(
+            equation_string
+        )
+        self.ec = ec
+        self.annotation = {}
+
+
+class BaseMetabolite(_Annotated):
+    """Metabolite behavior, without storage for its attributes."""
+
+    __slots__ = ()
 
     def match(self, query):
         """
@@ -146,12 +223,107 @@ class Metabolite:
         )
 
 
-# MetaNetX data will be read into memory into the following dicts, keyed by ID.
-compartments = {}
-reactions = {}
-metabolites = {}
+class Metabolite(BaseMetabolite):
+    __slots__ = ("mnx_id", "name", "formula", "annotation")
+
+    def __init__(self, mnx_id, name, formula):
+        # Interned to share the ID with the equations referring to it.
+        self.mnx_id = sys.intern(mnx_id)
+        self.name = name
+        self.formula = formula
+        self.annotation = {}
+
+
+# The data store objects of a dataset.
+OBJECTS = (
+    "compartments",
+    "reactions",
+    "metabolites",
+    "reaction_key_index",
+    "metabolite_key_index",
+    "reaction_namespace_index",
+    "metabolite_namespace_index",
+    "reaction_ngram_index",
+    "reaction_score_table",
+    "metabolite_substring_index",
+    "metabolite_deletion_index",
+)
+
+
+class Dataset:
+    """
+    One version of the MetaNetX data, with its indexes.
+
+    Datasets aren't modified once they're current. Loading a new release builds
+    a complete new dataset to the side and swaps it in at once, see `swap`.
+    The objects of the current dataset are available as attributes of this
+    module, such as `data.reactions`.
+    """
+
+    def __init__(self, version=None, **objects):
+        # The checksum of the source files the dataset was loaded from.
+        self.version = version
+        # MetaNetX data will be read into memory into the following dicts,
+        # keyed by ID.
+        self.compartments = {}
+        self.reactions = {}
+        self.metabolites = {}
+        # These dictionaries also include names and identifiers from other
+        # namespaces, lowercased for quick case-insensitive lookup.
+        self.reaction_key_index = {}
+        self.metabolite_key_index = {}
+        # Identifiers keyed by their namespace and exact identifier, such as
+        # ("bigg.metabolite", "glc__D"), including the MetaNetX IDs themselves.
+        # Unlike the key indexes above, identifiers from different namespaces
+        # never collide.
+        self.reaction_namespace_index = {}
+        self.metabolite_namespace_index = {}
+        # Character n-gram index over all reaction IDs, names, EC numbers and
+        # annotations, used to shortlist candidates for fuzzy searches.
+        self.reaction_ngram_index = NgramIndex()
+        # All reaction IDs, names, EC numbers and annotations in a columnar
+        # table, used to score fuzzy searches in bulk.
+        self.reaction_score_table = ScoreTable()
+        # Substring and typo-tolerant indexes over all metabolite IDs and
+        # names.
+        self.metabolite_substring_index = SubstringIndex()
+        self.metabolite_deletion_index = DeletionIndex()
+        for name, obj in objects.items():
+            if name not in OBJECTS:
+                raise ValueError(f"Unknown data store object '{name}'")
+            setattr(self, name, obj)
+
+
+_latest = Dataset()
+# The dataset a request is pinned to, per greenlet, or per thread without
+# greenlets. Context variables aren't used, since greenlets before 0.4.17 share
+# a single context.
+_pinned = Local()
+
+
+def current():
+    """Return the dataset the current request is pinned to, or the latest."""
+    dataset = getattr(_pinned, "dataset", None)
+    return _latest if dataset is None else dataset
+
+
+def swap(dataset):
+    """Make the dataset the latest, for requests starting from now on."""
+    global _latest
+    _latest = dataset
+
+
+def pin():
+    """Pin the current greenlet or thread to the latest dataset."""
+    _pinned.dataset = _latest
+
+
+def unpin():
+    release_local(_pinned)
+
 
-# These dictionaries also include names and identifiers from other namespaces,
-# lowercased for quick case-insensitive lookup.
-reaction_key_index = {}
-metabolite_key_index = {}
+def __getattr__(name):
+    # Resolve the data store objects in the current dataset.
+    if name in OBJECTS:
+        return getattr(current(), name)
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -0,0 +1,511 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Search indexes built over the MetaNetX data at load time."""
+
+import heapq
+import re
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+import Levenshtein
+import numpy as np
+from rapidfuzz import fuzz, process
+
+
+def cooperate():
+    """
+    Yield to other greenlets, if gevent patched `time.sleep` to switch to them.
+
+    Sleeps for a moment rather than for 0 seconds, since gevent doesn't run
+    expired timers or poll for I/O on `sleep(0)`. Without gevent, it returns
+    at once rather than making a system call.
+    """
+    monkey = sys.modules.get("gevent.monkey")
+    if monkey is not None and monkey.is_module_patched("time"):
+        time.sleep(1e-6)
+
+
+class Deadline:
+    """
+    Time budget of a search, which yields to other greenlets as it runs.
+
+    Long searches call `checkpoint` between chunks of work, which lets other
+    greenlets run under gevent (see `cooperate`), as they would otherwise wait
+    for the whole search.
+    """
+
+    def __init__(self, budget=None):
+        self._deadline = None if budget is None else time.monotonic() + budget
+        self.expired = False
+
+    def checkpoint(self):
+        """Yield to other greenlets and return whether the budget ran out."""
+        cooperate()
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            self.expired = True
+        return self.expired
+
+
+class NgramIndex:
+    """
+    Inverted index from character n-grams to the entries containing them.
+
+    Entries are kept in insertion order and referred to by their position, so
+    that results can be returned in the same order as the source dictionaries.
+    Keys are lowercased before they are split into n-grams.
+    """
+
+    def __init__(self, n=3):
+        self.n = n
+        self.entries = []
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def ngrams(self, string):
+        """Return the set of lowercased n-grams in the given string."""
+        string = string.lower()
+        if len(string) < self.n:
+            # Keep short keys searchable by indexing them as a single gram.
+            return {string} if string else set()
+        return {string[i : i + self.n] for i in range(len(string) - self.n + 1)}
+
+    def add(self, entry, keys):
+        """Add an entry, searchable by any of the given keys."""
+        position = len(self.entries)
+        self.entries.append(entry)
+        grams = set()
+        for key in keys:
+            # Names and EC numbers may be missing.
+            if key:
+                grams.update(self.ngrams(key))
+        for gram in grams:
+            try:
+                self.postings[gram].append(position)
+            except KeyError:
+                self.postings[gram] = array("l", (position,))
+
+    def shortlist(self, query, limit):
+        """
+        Return the entries sharing the most n-grams with the query.
+
+        At most `limit` entries are returned, in insertion order. Entries with
+        an equal number of shared n-grams are preferred by insertion order.
+        """
+        counts = Counter()
+        for gram in self.ngrams(query):
+            counts.update(self.postings.get(gram, ()))
+        if len(counts) > limit:
+            best = heapq.nlargest(
+                limit, counts.items(), key=lambda item: (item[1], -item[0])
+            )
+            positions = sorted(position for position, _ in best)
+        else:
+            positions = sorted(counts)
+        return [self.entries[position] for position in positions]
+
+
+class SubstringIndex:
+    """
+    Index for case-insensitive substring searches over the keys of entries.
+
+    Every key is lowercased, padded with terminators and split into trigrams,
+    so that every substring of a key of up to three characters is the prefix of
+    an indexed trigram. Longer substrings contain all of their own trigrams,
+    and candidates sharing them are verified against the lowercased keys. These
+    are kept UTF-8 encoded in a single buffer, delimited by terminators, where
+    the keys of every entry start at its offset. Entries are kept in insertion
+    order and referred to by their position.
+    """
+
+    n = 3
+    terminator = "\0"
+
+    def __init__(self):
+        self.entries = []
+        self.postings = {}
+        self.text = bytearray()
+        self.offsets = array("Q", (0,))
+        self._sorted_grams = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entry, keys):
+        """Add an entry, searchable by substrings of any of the given keys."""
+        position = len(self.entries)
+        self.entries.append(entry)
+        keys = [key.lower() for key in keys if key]
+        grams = set()
+        for key in keys:
+            key += self.terminator * (self.n - 1)
+            grams.update(
+                key[i : i + self.n] for i in range(len(key) - self.n + 1)
+            )
+        for gram in grams:
+            try:
+                self.postings[gram].append(position)
+            except KeyError:
+                self.postings[gram] = array("L", (position,))
+        self.text += "".join(key + self.terminator for key in keys).encode()
+        self.offsets.append(len(self.text))
+        self._sorted_grams = None
+
+    def find(self, query, limit):
+        """
+        Find the entries with a key containing the query.
+
+        Parameters
+        ----------
+        query : string
+            The substring to search for, case insensitively.
+        limit : int
+            The maximum number of entries to return.
+
+        Returns
+        -------
+        entries : list
+            The first `limit` matching entries, in insertion order.
+        total : int
+            The total number of matching entries. Candidates are only verified
+            until one match more than `limit` is found, and the total is then
+            estimated from the share of candidates that matched, so that it
+            exceeds `limit` exactly if there are more matches.
+
+        """
+        query = query.lower()
+        if not query:
+            return self.entries[:limit], len(self.entries)
+        if self.terminator in query:
+            return [], 0
+        if len(query) <= self.n:
+            # Entries with several n-grams starting with the query occur in
+            # several postings, but every one of them matches.
+            postings = self._prefixed_postings(query)
+            candidates = heapq.merge(*postings)
+            size = sum(len(positions) for positions in postings)
+
+            def verify(position):
+                return True
+
+        else:
+            postings = self._postings(query)
+            if not postings:
+                return [], 0
+            # Probe the longer posting lists for the few candidates of the
+            # shortest, and then search the keys of the remaining ones.
+            candidates, others = postings[0], postings[1:]
+            size = len(candidates)
+            needle = query.encode()
+            text, offsets = self.text, self.offsets
+
+            def verify(position):
+                return all(
+                    _contains(positions, position) for positions in others
+                ) and (
+                    text.find(needle, offsets[position], offsets[position + 1])
+                    >= 0
+                )
+
+        positions = []
+        scanned = 0
+        previous = None
+        for position in candidates:
+            scanned += 1
+            if position == previous:
+                continue
+            previous = position
+            if verify(position):
+                positions.append(position)
+                if len(positions) > limit:
+                    total = max(
+                        len(positions), round(len(positions) * size / scanned)
+                    )
+                    break
+        else:
+            total = len(positions)
+        return (
+            [self.entries[position] for position in positions[:limit]],
+            total,
+        )
+
+    def _prefixed_postings(self, query):
+        """Return the postings of all n-grams starting with the query."""
+        if self._sorted_grams is None:
+            self._sorted_grams = sorted(self.postings)
+        grams = self._sorted_grams
+        start = bisect_left(grams, query)
+        # The largest possible n-gram starting with the query.
+        last = query + chr(sys.maxunicode) * (self.n - len(query))
+        end = bisect_right(grams, last, start)
+        return [self.postings[gram] for gram in grams[start:end]]
+
+    def _postings(self, query):
+        """
+        Return the postings of all n-grams of the query, shortest first.
+
+        Returns an empty list if any n-gram isn't indexed.
+        """
+        n = self.n
+        grams = {query[i : i + n] for i in range(len(query) - n + 1)}
+        try:
+            return sorted((self.postings[gram] for gram in grams), key=len)
+        except KeyError:
+            return []
+
+
+def _contains(positions, position):
+    """Return whether the sorted positions contain the given position."""
+    index = bisect_left(positions, position)
+    return index < len(positions) and positions[index] == position
+
+
+class DeletionIndex:
+    """
+    Index for typo-tolerant searches over the keys of entries.
+
+    This is a SymSpell-style index: every lowercased key, and every word in it,
+    is a term, and the prefixes of all terms are indexed by all the variants
+    obtained by deleting up to `max_distance` characters. Terms within an edit
+    distance of a query share such a deletion variant with it, so candidates
+    are found by a few hash lookups and then verified by computing their actual
+    Levenshtein distance.
+    """
+
+    word_pattern = re.compile(r"[^\W_]{3,}")
+    # The number of candidate terms verified between checks of a deadline.
+    chunk_size = 64
+
+    def __init__(self, max_distance=2, prefix_length=7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.entries = []
+        # Term -> positions of the entries with that key, or a word in a key.
+        self.keys = {}
+        self.words = {}
+        self._prefixes = {}
+        self._deletions = {}
+        self._lengths = array("L")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entry, keys):
+        """Add an entry, searchable by approximations of the given keys."""
+        position = len(self.entries)
+        self.entries.append(entry)
+        keys = [key.lower() for key in keys if key]
+        self._lengths.append(sum(len(key) for key in keys))
+        # Deduplicate in order, so that the index doesn't depend on hashing.
+        words = dict.fromkeys(
+            word for key in keys for word in self.word_pattern.findall(key)
+        )
+        for terms, new_terms in (
+            (self.keys, dict.fromkeys(keys)),
+            (self.words, words),
+        ):
+            for term in new_terms:
+                try:
+                    terms[term].append(position)
+                except KeyError:
+                    terms[term] = array("L", (position,))
+                    self._add_term(term)
+
+    def _add_term(self, term):
+        prefix = term[: self.prefix_length]
+        try:
+            self._prefixes[prefix].add(term)
+            return
+        except KeyError:
+            self._prefixes[prefix] = {term}
+        for deletions in self._deletion_variants(prefix, self.max_distance):
+            for deletion in sorted(deletions):
+                self._deletions.setdefault(deletion, []).append(prefix)
+
+    @staticmethod
+    def _deletion_variants(string, max_distance):
+        """Yield the variants of a string with 0 to `max_distance` deletions."""
+        variants = {string}
+        yield variants
+        for _ in range(max_distance):
+            variants = {
+                variant[:index] + variant[index + 1 :]
+                for variant in variants
+                for index in range(len(variant))
+            }
+            yield variants
+
+    def find(self, query, limit, deadline=None):
+        """
+        Find the entries best approximating the query, best match first.
+
+        Entries are ranked by the edit distance of their closest term, whole
+        keys before words in a key, then shorter keys first and finally by
+        insertion order. The allowed edit distance is lowered for short
+        queries, which would otherwise approximate far too many terms.
+
+        Parameters
+        ----------
+        query : string
+            The search string, matched case insensitively.
+        limit : int
+            The maximum number of entries to return.
+        deadline : Deadline, optional
+            Verify the candidates in chunks, yielding to other greenlets
+            between them, and rank the ones found so far once the deadline
+            expires, which is then flagged as `deadline.expired`.
+
+        Returns
+        -------
+        entries : list
+            The best `limit` matching entries.
+        total : int
+            The total number of matching entries found.
+
+        """
+        query = query.lower()
+        max_distance = min(self.max_distance, (len(query) - 1) // 2)
+        if max_distance < 0:
+            return [], 0
+        ranks = {}
+        for count, term in enumerate(self._candidates(query, max_distance)):
+            if (
+                deadline is not None
+                and count
+                and count % self.chunk_size == 0
+                and deadline.checkpoint()
+            ):
+                break
+            distance = Levenshtein.distance(query, term)
+            if distance > max_distance:
+                continue
+            for is_word, terms in enumerate((self.keys, self.words)):
+                for position in terms.get(term, ()):
+                    length = self._lengths[position]
+                    rank = (distance, is_word, length, position)
+                    if rank < ranks.get(position, (max_distance + 1,)):
+                        ranks[position] = rank
+        best = heapq.nsmallest(limit, ranks.values())
+        return [self.entries[rank[-1]] for rank in best], len(ranks)
+
+    def _candidates(self, query, max_distance):
+        """Yield the terms which might approximate the query, closest first."""
+        prefix = query[: self.prefix_length]
+        seen = set()
+        for deletions in self._deletion_variants(prefix, max_distance):
+            for deletion in deletions:
+                for candidate in self._deletions.get(deletion, ()):
+                    if candidate not in seen:
+                        seen.add(candidate)
+                        yield from self._prefixes[candidate]
+
+
+class ScoreTable:
+    """
+    Columnar table of the strings that fuzzy searches match queries against.
+
+    All strings of all entries are kept in one contiguous column, grouped by
+    their owning entry, so that a query is scored against the whole table in a
+    single bulk call and then reduced to the best score per entry. Names are
+    kept in a separate column since they're matched on partial ratio.
+
+    Every entry must have at least one (non-empty) string.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.strings = []
+        self.names = []
+        self._starts = array("l")
+        self._name_owners = array("l")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entry, strings, name=None):
+        """Add an entry, with strings matched on ratio and an optional name."""
+        position = len(self.entries)
+        self.entries.append(entry)
+        self._starts.append(len(self.strings))
+        # Empty strings can't score, except against an empty query.
+        self.strings.extend(string for string in strings if string)
+        if name:
+            self.names.append(name)
+            self._name_owners.append(position)
+
+    def scores(self, query, start=0, stop=None):
+        """
+        Return the best score of every entry for the query.
+
+        Scores are rounded to integers like those of `fuzzywuzzy`. Names are
+        scored with rapidfuzz's partial ratio, which always finds the best
+        aligned substring, so scores can exceed fuzzywuzzy's partial ratio.
+        Only the entries from `start` up to `stop` are scored if given.
+        """
+        if stop is None or stop > len(self.entries):
+            stop = len(self.entries)
+        starts = np.frombuffer(self._starts, "l")
+        first = starts[start]
+        last = starts[stop] if stop < len(self.entries) else len(self.strings)
+        ratios = process.cdist(
+            [query],
+            self.strings[first:last],
+            scorer=fuzz.ratio,
+            processor=None,
+            dtype=np.float64,
+        )[0]
+        best = np.maximum.reduceat(ratios, starts[start:stop] - first)
+        owners = np.frombuffer(self._name_owners, "l")
+        first, last = np.searchsorted(owners, [start, stop])
+        if last > first:
+            owners = owners[first:last] - start
+            partial_ratios = process.cdist(
+                [query],
+                self.names[first:last],
+                scorer=fuzz.partial_ratio,
+                processor=None,
+                dtype=np.float64,
+            )[0]
+            best[owners] = np.maximum(best[owners], partial_ratios)
+        return np.rint(best)
+
+    def top_k(self, query, k, deadline=None, chunk_size=4096):
+        """
+        Return the `k` best matching entries, and the number of matches.
+
+        Entries are ranked best match first, and equally scored entries in
+        insertion order. Those scoring above 0 match the query. With a
+        deadline, entries are scored in chunks, and once the deadline expires
+        only the entries scored so far are ranked and counted.
+        """
+        if not self.entries:
+            return [], 0
+        if deadline is None:
+            scores = self.scores(query)
+        else:
+            chunks = []
+            for start in range(0, len(self.entries), chunk_size):
+                chunks.append(self.scores(query, start, start + chunk_size))
+                if deadline.checkpoint():
+                    break
+            scores = np.concatenate(chunks)
+        order = np.argsort(-scores, kind="stable")[:k]
+        matches = int(np.count_nonzero(scores))
+        return [self.entries[position] for position in order], matches
@@ -0,0 +1,200 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Reactions and metabolites whose annotations and equations are parsed on access.
+
+Most objects are never requested, yet building the annotation of every one of
+them takes much of the time and memory of loading the data store. Lazy objects
+write their cross-references to a sidecar file as they're read from the source
+files, and only remember the offset of their last one. Every line of the file
+holds the offset of the previous cross-reference of the same object, so that
+its whole annotation is read back by following the chain. Equations are only
+validated while loading. Annotations and parsed equations are materialized on
+first access and kept in a size-bounded cache.
+"""
+
+import os
+import re
+import sys
+import tempfile
+from functools import partial
+
+from .cache import MISSING, LRUCache
+from .data import BaseMetabolite, BaseReaction
+
+
+# The materialized annotations and equations of lazy objects, keyed by sidecar
+# and offset, and by equation string respectively.
+materialized = LRUCache(0)
+
+# Equations that `Reaction.parse_equation` accepts.
+_term = r"(?:\d+\.?\d*|\.\d+) \w+@\w+"
+_side = rf"{_term}(?: \+ {_term})*"
+EQUATION_PATTERN = re.compile(rf"{_side} = {_side}")
+
+# Offset of the last cross-reference of objects without any.
+NONE = -1
+
+
+def init_app(app):
+    """Size the cache of materialized annotations and equations."""
+    materialized.maxsize = app.config["LAZY_CACHE_SIZE"]
+
+
+def annotations(objects):
+    """
+    Yield the annotation of every object, lazy or not.
+
+    The sidecars of lazy objects are read at once rather than line by line,
+    and the annotations aren't cached, which would only evict the ones that
+    requests accessed.
+    """
+    lines = {}
+    for obj in objects:
+        if not isinstance(obj, _LazyRecord):
+            yield obj.annotation
+            continue
+        if obj._sidecar not in lines:
+            lines[obj._sidecar] = partial(_line_in, obj._sidecar.read())
+        yield _annotation(lines[obj._sidecar], obj._annotation_end)
+
+
+class Sidecar:
+    """
+    Anonymous file holding the cross-references of lazy objects.
+
+    The file is unlinked as soon as it's created and removed once closed, when
+    the sidecar is garbage collected. Forked processes share it, and read it
+    without moving the file position.
+    """
+
+    def __init__(self, directory=None):
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self._size = 0
+
+    def append(self, previous, namespace, identifier):
+        """Write a cross-reference following the previous one's offset."""
+        offset = self._size
+        line = f"{previous}\t{namespace}\t{identifier}\n".encode("utf-8")
+        self._file.write(line)
+        self._size += len(line)
+        return offset
+
+    def flush(self):
+        """Make the cross-references written so far readable."""
+        self._file.flush()
+
+    def read(self):
+        """Return the whole contents of the file."""
+        return os.pread(self._file.fileno(), self._size, 0)
+
+    def annotation(self, offset):
+        """Return the annotation whose last cross-reference is at offset."""
+        if offset == NONE:
+            return {}
+        annotation = materialized.get((self, offset))
+        if annotation is MISSING:
+            annotation = _annotation(self._line, offset)
+            materialized.set((self, offset), annotation)
+        return annotation
+
+    def _line(self, offset):
+        descriptor = self._file.fileno()
+        chunk = os.pread(descriptor, 256, offset)
+        while b"\n" not in chunk:
+            chunk += os.pread(descriptor, 4096, offset + len(chunk))
+        return chunk[: chunk.index(b"\n")]
+
+
+def _line_in(contents, offset):
+    return contents[offset : contents.index(b"\n", offset)]
+
+
+def _annotation(line, offset):
+    """Return the annotation ending at offset, reading lines by offset."""
+    references = []
+    while offset != NONE:
+        previous, namespace, identifier = (
+            line(offset).decode("utf-8").split("\t")
+        )
+        references.append((namespace, identifier))
+        offset = int(previous)
+    annotation = {}
+    for namespace, identifier in reversed(references):
+        annotation.setdefault(namespace, []).append(identifier)
+    return annotation
+
+
+class _LazyRecord:
+    """Mixin keeping the annotation of a data class in a sidecar."""
+
+    __slots__ = ()
+
+    @property
+    def annotation(self):
+        return self._sidecar.annotation(self._annotation_end)
+
+    def annotate(self, namespace, identifier):
+        self._annotation_end = self._sidecar.append(
+            self._annotation_end, namespace, identifier
+        )
+
+
+class LazyReaction(_LazyRecord, BaseReaction):
+    __slots__ = (
+        "mnx_id",
+        "name",
+        "equation_string",
+        "ec",
+        "_sidecar",
+        "_annotation_end",
+    )
+
+    def __init__(self, mnx_id, name, equation_string, ec, sidecar):
+        if not EQUATION_PATTERN.fullmatch(equation_string):
+            raise ValueError(f"Invalid equation: {equation_string}")
+        self.mnx_id = mnx_id
+        self.name = name
+        self.equation_string = equation_string
+        self.ec = ec
+        self._sidecar = sidecar
+        self._annotation_end = NONE
+
+    def _equation(self):
+        equation = materialized.get(self.equation_string)
+        if equation is MISSING:
+            equation = BaseReaction.compact_equation(self.equation_string)
+            materialized.set(self.equation_string, equation)
+        return equation
+
+    @property
+    def _species(self):
+        return self._equation()[0]
+
+    @property
+    def _coefficients(self):
+        return self._equation()[1]
+
+
+class LazyMetabolite(_LazyRecord, BaseMetabolite):
+    __slots__ = ("mnx_id", "name", "formula", "_sidecar", "_annotation_end")
+
+    def __init__(self, mnx_id, name, formula, sidecar):
+        self.mnx_id = sys.intern(mnx_id)
+        self.name = name
+        self.formula = formula
+        self._sidecar = sidecar
+        self._annotation_end = NONE
@@ -0,0 +1,130 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""WSGI middleware."""
+
+import io
+import json
+import zlib
+
+from werkzeug.exceptions import (
+    BadRequest,
+    HTTPException,
+    LengthRequired,
+    RequestEntityTooLarge,
+)
+from werkzeug.wrappers import Response
+
+
+class GzipRequest:
+    """
+    Limit the size of request bodies, and decompress gzip-encoded ones.
+
+    Flask only limits the bodies of forms to `MAX_CONTENT_LENGTH`, so larger
+    bodies of any request are rejected here. Clients posting large batches may
+    compress them and set the `Content-Encoding: gzip` header. Both the
+    compressed and the decompressed body are limited in size, to protect
+    against large and maliciously compressed bodies. Bodies without a
+    Content-Length, sent with chunked transfer encoding, are only read if the
+    server terminates the input stream.
+    """
+
+    def __init__(self, app, max_size):
+        self.app = app
+        self.max_size = max_size
+
+    def __call__(self, environ, start_response):
+        gzipped = environ.get("HTTP_CONTENT_ENCODING", "").lower() == "gzip"
+        try:
+            length = _content_length(environ)
+            if gzipped:
+                body = self._decompress(self._read_body(environ, length))
+                del environ["HTTP_CONTENT_ENCODING"]
+            elif length is not None:
+                # The body is read no further than its length.
+                if length > self.max_size:
+                    raise RequestEntityTooLarge()
+                body = None
+            elif environ.get("wsgi.input_terminated"):
+                body = self._read_body(environ, length)
+            else:
+                body = None
+        except HTTPException as error:
+            return _error(error)(environ, start_response)
+        if body is not None:
+            environ["wsgi.input"] = io.BytesIO(body)
+            environ["CONTENT_LENGTH"] = str(len(body))
+        return self.app(environ, start_response)
+
+    def _read_body(self, environ, length):
+        """Return the request body as sent, if it's within the limit."""
+        if length is not None:
+            if length > self.max_size:
+                raise RequestEntityTooLarge()
+        elif environ.get("wsgi.input_terminated"):
+            length = self.max_size + 1
+        else:
+            raise LengthRequired()
+        body = _read(environ["wsgi.input"], length)
+        if len(body) > self.max_size:
+            raise RequestEntityTooLarge()
+        return body
+
+    def _decompress(self, compressed):
+        """Return the decompressed request body."""
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(compressed, self.max_size + 1)
+        except zlib.error:
+            raise BadRequest("The request body isn't valid gzip.")
+        if len(body) > self.max_size:
+            raise RequestEntityTooLarge()
+        if not decompressor.eof or decompressor.unconsumed_tail:
+            raise BadRequest("The gzip request body is truncated.")
+        return body
+
+
+def _content_length(environ):
+    """Return the Content-Length of the request, or None if not given."""
+    if not environ.get("CONTENT_LENGTH"):
+        return None
+    try:
+        length = int(environ["CONTENT_LENGTH"])
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise BadRequest("Invalid Content-Length.")
+    return length
+
+
+def _read(stream, length):
+    """Read up to length bytes, until the end of the stream."""
+    chunks = []
+    while length > 0:
+        chunk = stream.read(min(length, 1 << 20))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        length -= len(chunk)
+    return b"".join(chunks)
+
+
+def _error(error):
+    """Return a JSON response like `errorhandlers.handle_http_error`."""
+    return Response(
+        json.dumps({"message": error.description}),
+        status=error.code,
+        mimetype="application/json",
+    )
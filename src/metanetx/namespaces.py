@@ -0,0 +1,63 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The namespaces of the identifiers in the MetaNetX data."""
+
+# The miriam namespaces of the MetaNetX namespaces of cross-references, see
+# `parser._miriam_identifiers`. KEGG metabolites are mapped by the first letter
+# of their identifier.
+COMPARTMENT_NAMESPACE_MAP = {
+    "bigg": "bigg.compartment",
+    "cco": "cco",
+    "go": "go",
+    "name": "name",  # unconfirmed
+    "seed": "seed",
+}
+REACTION_NAMESPACE_MAP = {
+    "bigg": "bigg.reaction",
+    "deprecated": "metanetx.reaction",
+    "kegg": "kegg.reaction",
+    "metacyc": "metacyc.reaction",
+    "reactome": "reactome",
+    "rhea": "rhea",
+    "sabiork": "sabiork.reaction",
+    "seed": "seed.reaction",
+}
+KEGG_NAMESPACE_MAP = {
+    "C": "kegg.compound",
+    "D": "kegg.drug",
+    "E": "kegg.environ",
+    "G": "kegg.glycan",
+}
+METABOLITE_NAMESPACE_MAP = {
+    "bigg": "bigg.metabolite",
+    "chebi": "chebi",
+    "deprecated": "metanetx.chemical",
+    "envipath": "envipath",  # unconfirmed
+    "hmdb": "hmdb",
+    "lipidmaps": "lipidmaps",
+    "metacyc": "metacyc.compound",
+    "reactome": "reactome",
+    "sabiork": "sabiork.compound",
+    "seed": "seed.compound",
+    "slm": "swisslipid",
+}
+
+# All namespaces of the identifiers of reactions and metabolites, including
+# their own MetaNetX IDs.
+REACTION_NAMESPACES = frozenset(REACTION_NAMESPACE_MAP.values())
+METABOLITE_NAMESPACES = frozenset(METABOLITE_NAMESPACE_MAP.values()) | set(
+    KEGG_NAMESPACE_MAP.values()
+)
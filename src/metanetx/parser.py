@@ -15,30 +15,318 @@
 
 """Functions to read MetaNetX source files."""
 
+import gc
 import gzip
+import hashlib
 import json
 import logging
+import multiprocessing
+import os
+import pickle
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-from .data import (
-    Compartment,
-    Metabolite,
-    Reaction,
-    compartments,
-    metabolite_key_index,
-    metabolites,
-    reaction_key_index,
-    reactions,
+from . import data
+from .data import Compartment, Metabolite, Reaction
+from .index import (
+    DeletionIndex,
+    NgramIndex,
+    ScoreTable,
+    SubstringIndex,
+    cooperate,
 )
+from .lazy import LazyMetabolite, LazyReaction, Sidecar, annotations
+from .namespaces import (
+    COMPARTMENT_NAMESPACE_MAP,
+    KEGG_NAMESPACE_MAP,
+    METABOLITE_NAMESPACE_MAP,
+    REACTION_NAMESPACE_MAP,
+)
+from .store import install, open_store, write_store
 
 
 logger = logging.getLogger(__name__)
 
+# All source files; a snapshot is only valid for their exact contents.
+SOURCES = (
+    "data/reaction_names.json.gz",
+    "data/comp_prop.tsv.gz",
+    "data/comp_xref.tsv.gz",
+    "data/reac_prop.tsv.gz",
+    "data/reac_xref.tsv.gz",
+    "data/chem_prop.tsv.gz",
+    "data/chem_xref.tsv.gz",
+)
+
+# Increment whenever the pickled objects change, to invalidate old snapshots.
+SNAPSHOT_VERSION = 4
+
+# The data store objects included in a snapshot.
+SNAPSHOT_OBJECTS = data.OBJECTS
+
+# The stages of loading the data store, in the order they complete: objects
+# that can be looked up by key, and then the search indexes.
+STAGES = ("lookups", "search")
+
+# The completed stages of loading the first dataset.
+loaded = set()
+# The exception which failed any stage of loading the first dataset in the
+# background.
+failure = None
+# The thread loading a dataset in the background, if any.
+loader = None
+# The options the last dataset was loaded with, to reload it with.
+options = {}
+
+
+def load_metanetx_data(
+    snapshot=None, processes=1, store=None, lazy=False, sidecar_directory=None
+):
+    """
+    Read the MetaNetX source files into a new dataset and make it current.
+
+    Parameters
+    ----------
+    snapshot : string, optional
+        Path to a snapshot written by `write_snapshot`. If it exists and was
+        written from the current source files, the data store is restored from
+        it rather than parsed from the source files.
+    processes : int, optional
+        The number of processes to parse the source files with. The
+        compartments, reactions and metabolites are parsed independently, so
+        more than three processes have no effect.
+    store : string, optional
+        Path to a packed, read-only data store (see `metanetx.store`), which is
+        written if it doesn't exist or is outdated. The compartments,
+        reactions and metabolites are then read from it rather than kept as
+        Python objects.
+    lazy : bool, optional
+        Parse the annotations of reactions and metabolites, and the equations
+        of reactions, only once they're accessed (see `metanetx.lazy`). Lazy
+        datasets are always parsed from the source files in a single process,
+        since a snapshot holds all parsed annotations.
+    sidecar_directory : string, optional
+        Directory of the anonymous file holding the annotations of lazy
+        datasets (default the temporary directory of `tempfile`).
+
+    Notes
+    -----
+    The stages in `STAGES` are added to `loaded` as they complete. Parsing the
+    source files in a single process without a packed store installs the
+    objects for lookups before building the search indexes; otherwise all
+    stages complete at once. Datasets loaded later, by `reload`, only replace
+    the current one once complete.
+
+    """
+    if lazy and processes > 1:
+        raise ValueError("Lazy datasets are parsed in a single process.")
+    options.update(
+        snapshot=snapshot,
+        processes=processes,
+        store=store,
+        lazy=lazy,
+        sidecar_directory=sidecar_directory,
+    )
+    checksum = _checksum()
+    version = checksum[:16]
+    objects = None
+    if snapshot and not lazy:
+        objects = _restore_snapshot(snapshot, checksum)
+    if objects is None:
+        staged = processes <= 1 and not store and not loaded
+        objects = _parse_metanetx_data(
+            processes, version if staged else None, lazy, sidecar_directory
+        )
+    dataset = data.Dataset(version, **objects)
+    if store:
+        _load_store(store, checksum, dataset)
+    _install(dataset, *STAGES)
+    logger.info(f"Serving version {version} of the data store")
+
+
+def start_loading(**kwargs):
+    """
+    Load a dataset in a background thread, see `load_metanetx_data`.
+
+    Under gevent, the thread is a greenlet, and parsing yields regularly to
+    let the worker serve requests meanwhile. Returns False, without loading,
+    if a dataset is already being loaded.
+    """
+    global loader
+    if loader is not None and loader.is_alive():
+        return False
+
+    def load():
+        global failure
+        try:
+            load_metanetx_data(**kwargs)
+        except Exception as error:
+            logger.exception("Failed to load the data store")
+            # Failing to reload a release leaves the current, fully loaded one
+            # in service, but failing any stage of the first one is fatal.
+            if not loaded.issuperset(STAGES):
+                failure = error
+
+    loader = threading.Thread(target=load, name="metanetx-loader", daemon=True)
+    loader.start()
+    return True
+
+
+def reload():
+    """Load the source files anew in the background, see `start_loading`."""
+    return start_loading(**options)
+
+
+def reload_on_signal(signum=signal.SIGUSR2):
+    """Reload the data store whenever the process receives the signal."""
+    signal.signal(signum, lambda *args: reload())
+
+
+def wait_until_loaded():
+    """Wait for the data store being loaded in the background, if any."""
+    if loader is not None:
+        loader.join()
 
-def load_metanetx_data():
-    with gzip.open("data/reaction_names.json.gz", "rt") as file_:
-        reaction_names = json.load(file_)
-    logger.info(f"Loaded {len(reaction_names)} reaction name mappings")
 
+def _install(dataset, *stages):
+    """Make the dataset current, and mark the stages as completed."""
+    data.swap(dataset)
+    for stage in stages:
+        if stage not in loaded:
+            loaded.add(stage)
+            logger.info(f"Loaded the data store for {stage}")
+
+
+def write_snapshot(path):
+    """
+    Write the loaded data store to a binary snapshot.
+
+    The snapshot holds the checksum of the source files it was loaded from, and
+    is written atomically so that loaders never see a partial snapshot.
+    """
+    header = {"version": SNAPSHOT_VERSION, "checksum": _checksum()}
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file_:
+        pickle.dump(header, file_, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(
+            {name: getattr(data, name) for name in SNAPSHOT_OBJECTS},
+            file_,
+            pickle.HIGHEST_PROTOCOL,
+        )
+    os.replace(temporary_path, path)
+    logger.info(f"Wrote snapshot of the data store to {path}")
+
+
+def _restore_snapshot(path, checksum):
+    """Return the data store objects from a snapshot, if it's valid."""
+    start = time.monotonic()
+    try:
+        file_ = open(path, "rb")
+    except FileNotFoundError:
+        logger.info(f"No snapshot at {path}, parsing the source files")
+        return None
+    with file_:
+        header = pickle.load(file_)
+        if header != {"version": SNAPSHOT_VERSION, "checksum": checksum}:
+            logger.warning(
+                f"The snapshot at {path} is outdated, parsing the source files"
+            )
+            return None
+        objects = _unpickle(file_.read())
+    logger.info(
+        f"Restored {len(objects['reactions'])} reactions and "
+        f"{len(objects['metabolites'])} metabolites from the snapshot at "
+        f"{path} in {time.monotonic() - start:.1f}s"
+    )
+    return objects
+
+
+def _load_store(path, checksum, dataset):
+    """Replace the objects of the dataset by the packed store at path."""
+    packed = open_store(path, checksum)
+    if packed is None:
+        write_store(path, checksum, dataset)
+        packed = open_store(path, checksum)
+    install(packed, dataset)
+    logger.info(f"Serving the data store from the packed store at {path}")
+
+
+def _unpickle(pickled):
+    # The data store consists of millions of small objects, which would trigger
+    # the cyclic garbage collector over and over while loading.
+    gc.disable()
+    try:
+        return pickle.loads(pickled)
+    finally:
+        gc.enable()
+
+
+def _checksum():
+    """Return the SHA-256 checksum of all source files."""
+    checksum = hashlib.sha256()
+    for path in SOURCES:
+        with open(path, "rb") as file_:
+            for chunk in iter(lambda: file_.read(1 << 20), b""):
+                checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def _parse_metanetx_data(
+    processes=1, staged_version=None, lazy=False, sidecar_directory=None
+):
+    """
+    Return the data store objects parsed from the source files.
+
+    If a version is given, a dataset of that version with the objects for
+    lookups is made current before the search indexes are built. Parsing in
+    multiple processes builds the indexes along with the objects, since their
+    entries must be the same objects. Lazy reactions and metabolites keep
+    their annotations in a sidecar file in the given directory.
+    """
+    start = time.monotonic()
+    if processes > 1:
+        parts = (
+            _parse_compartments,
+            _parse_indexed_reactions,
+            _parse_indexed_metabolites,
+        )
+        # Spawn fresh interpreters rather than forking, as the loading process
+        # may be a monkeypatched gevent server.
+        with ProcessPoolExecutor(
+            min(processes, len(parts)),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            futures = [executor.submit(_parse_pickled, part) for part in parts]
+            results = [_unpickle(future.result()) for future in futures]
+        objects = {}
+        for result in results:
+            objects.update(result)
+    else:
+        sidecar = Sidecar(sidecar_directory) if lazy else None
+        objects = _parse_compartments()
+        objects.update(_parse_reactions(sidecar))
+        objects.update(_parse_metabolites(sidecar))
+        if staged_version:
+            _install(data.Dataset(staged_version, **objects), "lookups")
+        objects.update(_index_reactions(objects["reactions"]))
+        objects.update(_index_metabolites(objects["metabolites"]))
+    logger.info(
+        f"Parsed {len(objects['reactions'])} reactions and "
+        f"{len(objects['metabolites'])} metabolites in "
+        f"{time.monotonic() - start:.1f}s using {max(processes, 1)} processes"
+    )
+    return objects
+
+
+def _parse_pickled(part):
+    """Parse one part of the data store in a worker process."""
+    return pickle.dumps(part(), pickle.HIGHEST_PROTOCOL)
+
+
+def _parse_compartments():
+    compartments = {}
     for line in _iterate_tsv(gzip.open("data/comp_prop.tsv.gz", "rt")):
         mnx_id, name, xref = line.rstrip("\n").split("\t")
         compartments[mnx_id] = Compartment(mnx_id, name, xref)
@@ -52,19 +340,32 @@ def load_metanetx_data():
             namespace, reference = _miriam_identifiers(
                 "compartment", namespace, reference
             )
-            compartment = compartments[mnx_id]
-            compartment.annotation[namespace].append(reference)
+            compartments[mnx_id].annotate(namespace, reference)
             compartment_xrefs += 1
     logger.info(f"Loaded {compartment_xrefs} compartment cross-references")
+    return {"compartments": compartments}
 
+
+def _parse_reactions(sidecar=None):
+    reactions = {}
+    reaction_key_index = {}
+    reaction_namespace_index = {}
+
+    with gzip.open("data/reaction_names.json.gz", "rt") as file_:
+        reaction_names = json.load(file_)
+    logger.info(f"Loaded {len(reaction_names)} reaction name mappings")
     filtered_reaction_count = 0
     for line in _iterate_tsv(gzip.open("data/reac_prop.tsv.gz", "rt")):
         mnx_id, equation, _, _, ec, _ = line.rstrip("\n").split("\t")
         name = reaction_names.get(mnx_id)
         try:
-            reaction = Reaction(mnx_id, name, equation, ec)
+            if sidecar is None:
+                reaction = Reaction(mnx_id, name, equation, ec)
+            else:
+                reaction = LazyReaction(mnx_id, name, equation, ec, sidecar)
             reactions[mnx_id] = reaction
             reaction_key_index[mnx_id.lower()] = reaction
+            reaction_namespace_index["metanetx.reaction", mnx_id] = reaction
             # We haven't been able to map names for all reactions, so ignore the
             # missing ones.
             if name:
@@ -99,20 +400,77 @@ def load_metanetx_data():
                 namespace, reference = _miriam_identifiers(
                     "reaction", namespace, reference
                 )
-                reaction.annotation[namespace].append(reference)
+                reaction.annotate(namespace, reference)
                 reaction_key_index[reference.lower()] = reaction
+                # Deprecated MetaNetX IDs mustn't replace the current ones.
+                reaction_namespace_index.setdefault(
+                    (namespace, reference), reaction
+                )
                 reaction_xrefs += 1
+    if sidecar is not None:
+        sidecar.flush()
     logger.info(
         f"Loaded {reaction_xrefs} reaction cross-references (ignored "
         f"{reaction_xrefs_missing} unknown references)"
     )
+    return {
+        "reactions": reactions,
+        "reaction_key_index": reaction_key_index,
+        "reaction_namespace_index": reaction_namespace_index,
+    }
+
+
+def _index_reactions(reactions):
+    reaction_ngram_index = NgramIndex()
+    reaction_score_table = ScoreTable()
+    for reaction, annotation in _cooperatively(
+        zip(reactions.values(), annotations(reactions.values()))
+    ):
+        identifiers = [
+            identifier
+            for identifiers in annotation.values()
+            for identifier in identifiers
+        ]
+        reaction_ngram_index.add(
+            reaction,
+            [reaction.mnx_id, reaction.name, reaction.ec] + identifiers,
+        )
+        reaction_score_table.add(
+            reaction,
+            [reaction.mnx_id, reaction.ec] + identifiers,
+            reaction.name,
+        )
+    logger.info(
+        f"Indexed {len(reaction_ngram_index.postings)} reaction search n-grams "
+        f"and {len(reaction_score_table.strings)} reaction search strings"
+    )
+    return {
+        "reaction_ngram_index": reaction_ngram_index,
+        "reaction_score_table": reaction_score_table,
+    }
+
+
+def _parse_indexed_reactions():
+    objects = _parse_reactions()
+    objects.update(_index_reactions(objects["reactions"]))
+    return objects
+
+
+def _parse_metabolites(sidecar=None):
+    metabolites = {}
+    metabolite_key_index = {}
+    metabolite_namespace_index = {}
 
     for line in _iterate_tsv(gzip.open("data/chem_prop.tsv.gz", "rt")):
         mnx_id, name, formula, _, _, _, _, _, _ = line.rstrip("\n").split("\t")
-        metabolite = Metabolite(mnx_id, name, formula)
+        if sidecar is None:
+            metabolite = Metabolite(mnx_id, name, formula)
+        else:
+            metabolite = LazyMetabolite(mnx_id, name, formula, sidecar)
         metabolites[mnx_id] = metabolite
         metabolite_key_index[mnx_id.lower()] = metabolite
         metabolite_key_index[name.lower()] = metabolite
+        metabolite_namespace_index["metanetx.chemical", mnx_id] = metabolite
     logger.info(f"Loaded {len(metabolites)} metabolites")
 
     metabolite_xrefs = 0
@@ -131,23 +489,65 @@ def load_metanetx_data():
                 namespace, reference = _miriam_identifiers(
                     "metabolite", namespace, reference
                 )
-                metabolite.annotation[namespace].append(reference)
+                metabolite.annotate(namespace, reference)
                 metabolite_key_index[reference.lower()] = metabolite
+                metabolite_namespace_index.setdefault(
+                    (namespace, reference), metabolite
+                )
                 metabolite_xrefs += 1
+    if sidecar is not None:
+        sidecar.flush()
     logger.info(
         f"Loaded {metabolite_xrefs} metabolite cross-references (ignored "
         f"{metabolite_xrefs_missing} unknown references)"
     )
+    return {
+        "metabolites": metabolites,
+        "metabolite_key_index": metabolite_key_index,
+        "metabolite_namespace_index": metabolite_namespace_index,
+    }
+
+
+def _index_metabolites(metabolites):
+    metabolite_substring_index = SubstringIndex()
+    metabolite_deletion_index = DeletionIndex()
+    for metabolite in _cooperatively(metabolites.values()):
+        keys = [metabolite.mnx_id, metabolite.name]
+        metabolite_substring_index.add(metabolite, keys)
+        metabolite_deletion_index.add(metabolite, keys)
+    logger.info(
+        f"Indexed {len(metabolite_substring_index.postings)} metabolite search "
+        f"n-grams and {len(metabolite_deletion_index.keys)} metabolite search "
+        "terms"
+    )
+    return {
+        "metabolite_substring_index": metabolite_substring_index,
+        "metabolite_deletion_index": metabolite_deletion_index,
+    }
+
+
+def _parse_indexed_metabolites():
+    objects = _parse_metabolites()
+    objects.update(_index_metabolites(objects["metabolites"]))
+    return objects
 
 
 def _iterate_tsv(file_):
     with file_:
-        for line in file_:
+        for line in _cooperatively(file_):
             if line.startswith("#"):
                 continue
             yield line
 
 
+def _cooperatively(iterable, chunk_size=5000):
+    """Iterate, yielding to other greenlets between chunks of items."""
+    for position, item in enumerate(iterable):
+        if position % chunk_size == 0:
+            cooperate()
+        yield item
+
+
 def _miriam_identifiers(type_, namespace, identifier):
     """
     Fix the MetaNetX identifiers into miriam equivalents.
@@ -174,49 +574,14 @@ def _miriam_identifiers(type_, namespace, identifier):
 
     """
     if type_ == "compartment":
-        ns_map = {
-            "bigg": "bigg.compartment",
-            "cco": "cco",
-            "go": "go",
-            "name": "name",  # unconfirmed
-            "seed": "seed",
-        }
-        return (ns_map[namespace], identifier)
+        return (COMPARTMENT_NAMESPACE_MAP[namespace], identifier)
     elif type_ == "reaction":
-        ns_map = {
-            "bigg": "bigg.reaction",
-            "deprecated": "metanetx.reaction",
-            "kegg": "kegg.reaction",
-            "metacyc": "metacyc.reaction",
-            "reactome": "reactome",
-            "rhea": "rhea",
-            "sabiork": "sabiork.reaction",
-            "seed": "seed.reaction",
-        }
-        return (ns_map[namespace], identifier)
+        return (REACTION_NAMESPACE_MAP[namespace], identifier)
     elif type_ == "metabolite":
         if namespace == "kegg":
-            kegg_map = {
-                "C": "kegg.compound",
-                "D": "kegg.drug",
-                "E": "kegg.environ",
-                "G": "kegg.glycan",
-            }
-            return (kegg_map[identifier[0]], identifier)
+            return (KEGG_NAMESPACE_MAP[identifier[0]], identifier)
         elif namespace == "slm":
-            return ("swisslipid", f"SLM:{identifier}")
+            identifier = f"SLM:{identifier}"
         elif namespace == "chebi":
-            return (namespace, f"CHEBI:{identifier}")
-        else:
-            ns_map = {
-                "bigg": "bigg.metabolite",
-                "deprecated": "metanetx.chemical",
-                "envipath": "envipath",  # unconfirmed
-                "hmdb": "hmdb",
-                "lipidmaps": "lipidmaps",
-                "metacyc": "metacyc.compound",
-                "reactome": "reactome",
-                "sabiork": "sabiork.compound",
-                "seed": "seed.compound",
-            }
-            return (ns_map[namespace], identifier)
+            identifier = f"CHEBI:{identifier}"
+        return (METABOLITE_NAMESPACE_MAP[namespace], identifier)
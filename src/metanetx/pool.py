@@ -0,0 +1,224 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Run CPU-bound searches in a pool of forked processes.
+
+Gevent workers serve requests concurrently only while they wait for I/O, so
+scoring search candidates blocks every other request on the worker, and a
+worker never uses more than one core. The search pool forks processes from the
+worker once the data store is loaded, which hence share its memory, and talks
+to each over a socket pair. Under gevent, waiting for a result is I/O like any
+other, during which the worker keeps serving requests. Once the worker loads a
+new dataset, it searches by itself again, until it's restarted.
+
+Processes are only forked before the worker serves requests, since forking
+from a greenlet serving a request would continue the other greenlets, and the
+server accepting connections, in the forked process. A process whose search
+fails or is interrupted is hence stopped rather than replaced, and the worker
+searches by itself once none are left.
+"""
+
+import logging
+import os
+import pickle
+import queue
+import signal
+import socket
+import struct
+
+from . import data
+
+
+logger = logging.getLogger(__name__)
+
+# The length of a pickled message.
+HEADER = struct.Struct("<Q")
+
+# The search pool of this process, if enabled.
+pool = None
+
+
+def init_app(app):
+    """Configure the search pool, which is started by `start`."""
+    global pool
+    if pool is not None:
+        pool.close()
+    processes = app.config["SEARCH_PROCESSES"]
+    pool = SearchPool(processes) if processes > 0 else None
+
+
+def start():
+    """
+    Fork the processes of the search pool, if enabled and not yet started.
+
+    Gunicorn workers call this after loading the app, but before serving any
+    requests: forking while other greenlets are running would continue them
+    in the forked processes too.
+    """
+    if pool is not None:
+        pool.start()
+
+
+def run(function, *args, **kwargs):
+    """
+    Return the result of calling the function, in the search pool if enabled.
+
+    The function must be defined at the top level of a module, and its
+    arguments and result must be picklable. Exceptions are raised as is. The
+    function is called in this process unless `start` forked the pool from it,
+    since forking from a greenlet serving a request would continue the other
+    greenlets in the forked processes.
+    """
+    if pool is None or not pool.started:
+        return function(*args, **kwargs)
+    # The processes hold the dataset which was current when they were forked.
+    if pool.version != data.current().version:
+        return function(*args, **kwargs)
+    return pool.run(function, *args, **kwargs)
+
+
+class SearchPool:
+    """Pool of processes forked from the current one, running functions."""
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.version = None
+        self._pid = None
+        self._children = []
+        self._idle = queue.Queue()
+
+    @property
+    def started(self):
+        """Return whether the processes were forked from this process."""
+        return self._pid == os.getpid()
+
+    def start(self):
+        # Processes are forked anew in any forked process, which can't share
+        # the sockets of its parent.
+        if self.started:
+            return
+        self._pid = os.getpid()
+        self.version = data.current().version
+        self._children = []
+        self._idle = queue.Queue()
+        for _ in range(self.processes):
+            self._children.append(_fork(self._children))
+            self._idle.put(self._children[-1][1])
+        logger.info(f"Started {self.processes} search processes")
+
+    def run(self, function, *args, **kwargs):
+        connection = self._idle.get()
+        if connection is None:
+            # All processes were stopped; let any other waiters know too.
+            self._idle.put(None)
+            return function(*args, **kwargs)
+        try:
+            _send(connection, (function, args, kwargs))
+            succeeded, result = _receive(connection)
+        except BaseException:
+            # The connection is in an unknown state, so the process is
+            # stopped rather than reused.
+            self._stop(connection)
+            raise
+        self._idle.put(connection)
+        if not succeeded:
+            raise result
+        return result
+
+    def close(self):
+        """Stop the processes of the pool, if started in this process."""
+        if not self.started:
+            return
+        for pid, connection in self._children:
+            connection.close()
+            os.waitpid(pid, 0)
+        self._children = []
+        self._pid = None
+
+    def _stop(self, connection):
+        for index, (pid, parent) in enumerate(self._children):
+            if parent is connection:
+                parent.close()
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                del self._children[index]
+                logger.warning(
+                    "Stopped a failed search process, "
+                    f"{len(self._children)} remaining"
+                )
+                if not self._children:
+                    self._idle.put(None)
+                return
+
+
+def _fork(siblings):
+    """Fork a process serving a new connection, and return both."""
+    parent, child = socket.socketpair()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            # Only the parent may hold the connections to the processes, so
+            # that they're closed when it exits.
+            for _, connection in siblings:
+                connection.close()
+            parent.close()
+            _serve(child)
+        finally:
+            os._exit(0)
+    child.close()
+    return pid, parent
+
+
+def _serve(connection):
+    """Run the functions received over the connection until it's closed."""
+    # Interrupts are meant for the parent, which closes the connection.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    while True:
+        try:
+            function, args, kwargs = _receive(connection)
+        except EOFError:
+            return
+        try:
+            reply = pickle.dumps(
+                (True, function(*args, **kwargs)), pickle.HIGHEST_PROTOCOL
+            )
+        except Exception as error:
+            reply = pickle.dumps((False, error), pickle.HIGHEST_PROTOCOL)
+        _send_pickled(connection, reply)
+
+
+def _send(connection, message):
+    _send_pickled(connection, pickle.dumps(message, pickle.HIGHEST_PROTOCOL))
+
+
+def _send_pickled(connection, pickled):
+    connection.sendall(HEADER.pack(len(pickled)) + pickled)
+
+
+def _receive(connection):
+    (length,) = HEADER.unpack(_receive_exactly(connection, HEADER.size))
+    return pickle.loads(_receive_exactly(connection, length))
+
+
+def _receive_exactly(connection, length):
+    buffer = bytearray()
+    while len(buffer) < length:
+        chunk = connection.recv(min(length - len(buffer), 1 << 20))
+        if not chunk:
+            raise EOFError("The connection was closed")
+        buffer += chunk
+    return bytes(buffer)
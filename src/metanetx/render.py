@@ -0,0 +1,255 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Render JSON responses from memoized fragments.
+
+Marshalling a response walks the nested schemas field by field for every
+object, which costs more than looking up the objects themselves. Instead, the
+JSON of every object is rendered once through its schema and memoized, and
+responses are assembled by joining the fragments. The resources keep their
+`marshal_with` annotations, which document the responses.
+"""
+
+from functools import lru_cache
+
+from flask import current_app, json, stream_with_context
+
+from . import data
+from .cache import MISSING, LRUCache
+from .schemas import (
+    CompartmentSchema,
+    MetaboliteSchema,
+    ReactionResponseSchema,
+    ReactionSchema,
+)
+
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# The nested objects of a reaction response.
+REACTION_RESPONSE_FIELDS = ("reaction", "metabolites", "compartments")
+
+# Rendered JSON fragments, keyed by dataset version, schema, fields and
+# MetaNetX ID.
+fragments = LRUCache(0)
+
+
+def init_app(app):
+    """Size the fragment cache."""
+    fragments.maxsize = app.config["RENDER_CACHE_SIZE"]
+
+
+def reactions_response(mnx_ids, headers=None, stream=False, only=None):
+    """
+    Return a response rendering reactions like `ReactionResponseSchema`.
+
+    Parameters
+    ----------
+    mnx_ids : iterable
+        The IDs of the reactions to render with their references, or None for
+        missing reactions, which are rendered as empty objects.
+    headers : dict, optional
+        Additional response headers.
+    stream : bool, optional
+        Stream newline-delimited JSON, rendering each reaction as the IDs are
+        iterated, rather than a JSON list.
+    only : list, optional
+        Render only these fields, as the `only` argument of the schema. The
+        objects or attributes of unrendered fields aren't accessed at all.
+
+    """
+    only = _normalize_only(only)
+    schema = _schema(ReactionResponseSchema, only)
+    nested = _nested_only(only)
+    if nested.keys() <= {"reaction"}:
+
+        def load(mnx_id):
+            return {"reaction": data.reactions[mnx_id]}
+
+    else:
+
+        def load(mnx_id):
+            return data.reactions[mnx_id].with_references()
+
+    return _response(
+        (
+            _fragment(schema, only, mnx_id, lambda: load(mnx_id))
+            if mnx_id
+            else None
+            for mnx_id in mnx_ids
+        ),
+        headers,
+        stream,
+    )
+
+
+def metabolites_response(mnx_ids, headers=None, stream=False, only=None):
+    """Return a response rendering metabolites like `MetaboliteSchema`."""
+    only = _normalize_only(only)
+    schema = _schema(MetaboliteSchema, only)
+    return _response(
+        (
+            _fragment(schema, only, mnx_id, lambda: data.metabolites[mnx_id])
+            if mnx_id
+            else None
+            for mnx_id in mnx_ids
+        ),
+        headers,
+        stream,
+    )
+
+
+def normalized_reactions_response(mnx_ids, headers=None, only=None):
+    """
+    Return a response rendering reactions like `NormalizedReactionResponse`.
+
+    The referenced metabolites and compartments are rendered once each, in
+    lookup tables keyed by ID. Fields are given as for `reactions_response`,
+    and the lookup tables are left out unless their fields are requested.
+    """
+    nested = _nested_only(only)
+    reaction_schema = _schema(ReactionSchema, nested.get("reaction"))
+    reactions = []
+    metabolite_ids = set()
+    compartment_ids = set()
+    for mnx_id in mnx_ids:
+        if not mnx_id:
+            reactions.append(b"{}")
+            continue
+        reaction = data.reactions[mnx_id]
+        if "reaction" in nested:
+            reactions.append(
+                _fragment(
+                    reaction_schema,
+                    nested["reaction"],
+                    mnx_id,
+                    lambda: reaction,
+                )
+            )
+        else:
+            reactions.append(b"{}")
+        if nested.keys() & {"metabolites", "compartments"}:
+            metabolites, compartments = reaction.references()
+            metabolite_ids.update(metabolites)
+            compartment_ids.update(compartments)
+    parts = []
+    for name, schema_class, ids, lookup in (
+        ("compartments", CompartmentSchema, compartment_ids, data.compartments),
+        ("metabolites", MetaboliteSchema, metabolite_ids, data.metabolites),
+    ):
+        if name in nested:
+            schema = _schema(schema_class, nested[name])
+            parts.append(
+                b'"%s":' % name.encode()
+                + _json_object(
+                    (i, _fragment(schema, nested[name], i, lambda: lookup[i]))
+                    for i in sorted(ids)
+                )
+            )
+    parts.append(b'"reactions":[' + b",".join(reactions) + b"]")
+    return current_app.response_class(
+        b"{" + b",".join(parts) + b"}\n",
+        mimetype=current_app.config["JSONIFY_MIMETYPE"],
+        headers=headers,
+    )
+
+
+def json_response(items, headers=None):
+    """Return a JSON response of a list of fragments (None for `{}`)."""
+    body = b",".join(b"{}" if item is None else item for item in items)
+    return current_app.response_class(
+        b"[" + body + b"]\n",
+        mimetype=current_app.config["JSONIFY_MIMETYPE"],
+        headers=headers,
+    )
+
+
+def ndjson_response(items, headers=None):
+    """Return a streamed response of fragments, one per line."""
+    return current_app.response_class(
+        stream_with_context(
+            b"{}\n" if item is None else item + b"\n" for item in items
+        ),
+        mimetype=NDJSON_MIMETYPE,
+        headers=headers,
+    )
+
+
+def _response(items, headers, stream):
+    if stream:
+        return ndjson_response(items, headers)
+    return json_response(items, headers)
+
+
+def _normalize_only(only):
+    """Return the fields as a hashable, canonical tuple, or None for all."""
+    return tuple(sorted(set(only))) if only else None
+
+
+def _nested_only(only):
+    """
+    Return the fields of each nested object of a reaction response.
+
+    Maps the requested nested objects to their requested fields, or to None for
+    all fields.
+    """
+    if not only:
+        return dict.fromkeys(REACTION_RESPONSE_FIELDS)
+    nested = {}
+    for field in only:
+        name, _, nested_field = field.partition(".")
+        if not nested_field:
+            nested[name] = None
+        elif nested.get(name, ()) is not None:
+            nested[name] = _normalize_only(
+                nested.get(name, ()) + (nested_field,)
+            )
+    return nested
+
+
+@lru_cache(maxsize=256)
+def _schema(schema_class, only):
+    """Return a schema instance dumping the given fields."""
+    return schema_class(only=only)
+
+
+def _json_object(items):
+    """Return a JSON object of the key and fragment pairs."""
+    return (
+        b"{"
+        + b",".join(
+            json.dumps(key).encode("utf-8") + b":" + fragment
+            for key, fragment in items
+        )
+        + b"}"
+    )
+
+
+def _fragment(schema, only, mnx_id, load):
+    """
+    Return the memoized JSON of the object, loading it if not rendered.
+
+    The fragment is memoized by the fields the schema was created with, as
+    `schema.only` reduces nested fields to the names of their objects.
+    """
+    key = (data.current().version, type(schema).__name__, only, mnx_id)
+    fragment = fragments.get(key)
+    if fragment is MISSING:
+        fragment = json.dumps(
+            schema.dump(load()), separators=(",", ":")
+        ).encode("utf-8")
+        fragments.set(key, fragment)
+    return fragment
@@ -15,17 +15,55 @@
 
 """Implement RESTful API endpoints using resources."""
 
+import hmac
 import warnings
 
+from flask import current_app, jsonify, request
 from flask_apispec import MethodResource, marshal_with, use_kwargs
 from flask_apispec.extension import FlaskApiSpec
+from werkzeug.exceptions import (
+    Conflict,
+    Forbidden,
+    InternalServerError,
+    ServiceUnavailable,
+)
 
-from . import data
+from . import data, parser, pool, render, search
+from .cache import cached, flight_stats, stats
 from .schemas import (
-    BatchSearchSchema,
+    Cursor,
+    MetaboliteBatchLookupSchema,
+    MetaboliteBatchSearchSchema,
     MetaboliteSchema,
+    MetaboliteSearchSchema,
+    MetaboliteTranslationLookupSchema,
+    MetaboliteTranslationSearchSchema,
+    NormalizedReactionResponseSchema,
+    ReactionBatchLookupSchema,
+    ReactionBatchSearchSchema,
     ReactionResponseSchema,
-    SearchSchema,
+    ReactionSearchSchema,
+    ReactionTranslationLookupSchema,
+    ReactionTranslationSearchSchema,
+    TranslationResponseSchema,
+)
+
+
+# The stage of loading the data store that each resource requires.
+REQUIRED_STAGES = {
+    "ReactionResource": "search",
+    "ReactionBatchResource": "lookups",
+    "MetaboliteResource": "search",
+    "MetaboliteBatchResource": "lookups",
+    "ReactionTranslationResource": "lookups",
+    "MetaboliteTranslationResource": "lookups",
+}
+
+# OpenAPI 2 documents a single schema per response code, so normalized
+# reaction responses are described as a separately registered definition.
+REACTIONS_DESCRIPTION = (
+    "The reactions with their references, or with `normalize=true` a "
+    "`NormalizedReactionResponse` listing the references once."
 )
 
 
@@ -39,72 +77,407 @@ def init_app(app):
             docs.register(resource, endpoint=resource.__name__)
 
     docs = FlaskApiSpec(app)
+    docs.spec.components.schema(
+        "NormalizedReactionResponse", schema=NormalizedReactionResponseSchema
+    )
+    app.before_request(pin_dataset)
+    app.before_request(require_loaded)
+    app.after_request(add_version_header)
+    app.teardown_request(unpin_dataset)
     app.add_url_rule("/healthz", view_func=healthz)
+    app.add_url_rule("/healthz/live", view_func=liveness)
+    app.add_url_rule("/stats", view_func=statistics)
+    if app.config["ADMIN_TOKEN"]:
+        app.add_url_rule(
+            "/admin/reload", view_func=reload_dataset, methods=["POST"]
+        )
     register("/reactions", ReactionResource)
     register("/reactions/batch", ReactionBatchResource)
     register("/metabolites", MetaboliteResource)
     register("/metabolites/batch", MetaboliteBatchResource)
+    register("/reactions/translate", ReactionTranslationResource)
+    register("/metabolites/translate", MetaboliteTranslationResource)
 
 
 def healthz():
     """
-    Return an empty, successful response for readiness checks.
+    Report the loaded stages of the data store, for readiness checks.
 
-    A successful response signals that the app is initialized and ready to
-    receive traffic. The main use case is for apps with slow initialization, but
-    external dependencies like database connections can also be tested here.
+    A successful response signals that the app is ready to receive traffic,
+    which is once the data for lookups is loaded, while the search indexes
+    might still be built. Until then, the response is 503 Service Unavailable.
     """
+    response = jsonify(
+        {"stages": {stage: stage in parser.loaded for stage in parser.STAGES}}
+    )
+    if parser.STAGES[0] not in parser.loaded:
+        response.status_code = 503
+    return response
+
+
+def liveness():
+    """Return an empty response for liveness checks, failing if loading did."""
+    if parser.failure is not None:
+        raise InternalServerError("Failed to load the data store.")
     return ""
 
 
+def pin_dataset():
+    """Pin the request to the current dataset, for it to finish against."""
+    data.pin()
+
+
+def unpin_dataset(error=None):
+    data.unpin()
+
+
+def add_version_header(response):
+    version = data.current().version
+    if version is not None:
+        response.headers["X-Dataset-Version"] = version
+    return response
+
+
+def reload_dataset():
+    """
+    Load the source files anew in the background, and swap in the new dataset.
+
+    Only reloads the worker serving the request; signal every worker with
+    SIGUSR2 to reload them all.
+    """
+    token = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(
+        token.encode(), f"Bearer {current_app.config['ADMIN_TOKEN']}".encode()
+    ):
+        raise Forbidden("Invalid admin token.")
+    if not parser.reload():
+        raise Conflict("A dataset is already being loaded.")
+    response = jsonify({"version": data.current().version})
+    response.status_code = 202
+    return response
+
+
+def require_loaded():
+    """Reject requests to resources whose data isn't loaded yet."""
+    stage = REQUIRED_STAGES.get(request.endpoint)
+    if stage is not None and stage not in parser.loaded:
+        raise ServiceUnavailable("The data store is still being loaded.")
+
+
+def statistics():
+    """Return the statistics of the caches and of coalesced queries."""
+    return jsonify(
+        {
+            "caches": stats(),
+            "fragments": render.fragments.stats(),
+            "flights": flight_stats(),
+        }
+    )
+
+
 class ReactionResource(MethodResource):
-    @use_kwargs(SearchSchema)
-    @marshal_with(ReactionResponseSchema(many=True), code=200)
-    def get(self, query):
-        # Search through the data store for matching reactions.
-        reactions = sorted(
-            data.reactions.values(), key=lambda r: r.match(query), reverse=True
+    @use_kwargs(ReactionSearchSchema)
+    @marshal_with(
+        ReactionResponseSchema(many=True),
+        code=200,
+        description=REACTIONS_DESCRIPTION,
+    )
+    def get(self, query, normalize, limit, cursor, only=None):
+        # Search through the data store for matching reactions. The ranking is
+        # computed to a fixed depth once per query, and pages are sliced from
+        # it. Fuzzy scores are case sensitive, so the query is used as is.
+        # Searches running out of time return the best reactions scored so
+        # far, which aren't cached.
+        depth = current_app.config["SEARCH_RESULT_DEPTH"]
+        mnx_ids, total, partial = cached(
+            "reactions",
+            (depth, query),
+            lambda: pool.run(
+                search.rank_reactions,
+                query,
+                depth,
+                budget=current_app.config["REACTION_SEARCH_BUDGET"],
+                engine=current_app.config["REACTION_SEARCH_ENGINE"],
+                shortlist=current_app.config["REACTION_SEARCH_SHORTLIST"],
+            ),
+            keep=lambda result: not result[2],
         )
-
-        # Limit the results to the first 30.
-        reactions = reactions[:30]
+        mnx_ids, headers = _page(mnx_ids, cursor, limit, total)
+        if partial:
+            headers["X-Search-Partial"] = "true"
 
         # Collect all unique references to metabolites and compartments, and
         # include the objects in the response.
-        return [reaction.with_references() for reaction in reactions]
+        return _reactions_response(mnx_ids, normalize, only, headers=headers)
 
 
 class ReactionBatchResource(MethodResource):
-    @use_kwargs(BatchSearchSchema)
-    @marshal_with(ReactionResponseSchema(many=True), code=200)
-    def get(self, query):
+    @use_kwargs(ReactionBatchSearchSchema)
+    @marshal_with(
+        ReactionResponseSchema(many=True),
+        code=200,
+        description=REACTIONS_DESCRIPTION,
+    )
+    def get(self, query, normalize, format=None, only=None):
         # Search through the data store for multiple exact matching reactions.
-        results = []
-        for q in query:
-            try:
-                results.append(
-                    data.reaction_key_index[q.lower()].with_references()
-                )
-            except KeyError:
-                results.append(None)
-        return results
+        indexes = (data.reaction_key_index, data.reaction_namespace_index)
+        if _streamed(format) and not normalize:
+            return render.reactions_response(
+                (_lookup_id(*indexes, q) for q in query),
+                stream=True,
+                only=only,
+            )
+        keys = tuple(_lookup_key(q) for q in query)
+        mnx_ids = cached(
+            "reactions_batch", keys, lambda: _lookup_ids(*indexes, keys)
+        )
+        return _reactions_response(mnx_ids, normalize, only)
+
+    @use_kwargs(ReactionBatchLookupSchema, locations=("json",))
+    @marshal_with(
+        ReactionResponseSchema(many=True),
+        code=200,
+        description=REACTIONS_DESCRIPTION,
+    )
+    def post(self, query, normalize, format=None, only=None):
+        # Look up large batches of exact matching reactions, posted as JSON.
+        return _reactions_response(
+            _lookup_unique_ids(
+                data.reaction_key_index, data.reaction_namespace_index, query
+            ),
+            normalize,
+            only,
+            stream=_streamed(format),
+        )
 
 
 class MetaboliteResource(MethodResource):
-    @use_kwargs(SearchSchema)
+    @use_kwargs(MetaboliteSearchSchema)
     @marshal_with(MetaboliteSchema(many=True), code=200)
-    def get(self, query):
-        # Search through the data store for matching metabolites.
-        metabolites = [m for m in data.metabolites.values() if m.match(query)]
-
-        # Limit the results to the first 30.
-        metabolites = metabolites[:30]
-        return metabolites
+    def get(self, query, mode, limit, cursor, only=None):
+        # Search through the data store for matching metabolites, paging
+        # through the results as for reactions. Both modes are case
+        # insensitive. Fuzzy searches running out of time return the matches
+        # found so far, which aren't cached.
+        depth = current_app.config["SEARCH_RESULT_DEPTH"]
+        mnx_ids, total, partial = cached(
+            "metabolites",
+            (depth, mode, query.lower()),
+            lambda: pool.run(
+                search.rank_metabolites,
+                query,
+                depth,
+                mode=mode,
+                budget=current_app.config["METABOLITE_FUZZY_SEARCH_BUDGET"],
+            ),
+            keep=lambda result: not result[2],
+        )
+        mnx_ids, headers = _page(mnx_ids, cursor, limit, total)
+        if partial:
+            headers["X-Search-Partial"] = "true"
+        return render.metabolites_response(mnx_ids, headers, only=only)
 
 
 class MetaboliteBatchResource(MethodResource):
-    @use_kwargs(BatchSearchSchema)
+    @use_kwargs(MetaboliteBatchSearchSchema)
     @marshal_with(MetaboliteSchema(many=True), code=200)
-    def get(self, query):
+    def get(self, query, format=None, only=None):
         # Search through the data store for multiple exact matching reactions.
-        return [data.metabolite_key_index.get(q.lower()) for q in query]
+        indexes = (data.metabolite_key_index, data.metabolite_namespace_index)
+        if _streamed(format):
+            return render.metabolites_response(
+                (_lookup_id(*indexes, q) for q in query),
+                stream=True,
+                only=only,
+            )
+        keys = tuple(_lookup_key(q) for q in query)
+        mnx_ids = cached(
+            "metabolites_batch", keys, lambda: _lookup_ids(*indexes, keys)
+        )
+        return render.metabolites_response(mnx_ids, only=only)
+
+    @use_kwargs(MetaboliteBatchLookupSchema, locations=("json",))
+    @marshal_with(MetaboliteSchema(many=True), code=200)
+    def post(self, query, format=None, only=None):
+        # Look up large batches of exact matching metabolites, posted as JSON.
+        return render.metabolites_response(
+            _lookup_unique_ids(
+                data.metabolite_key_index,
+                data.metabolite_namespace_index,
+                query,
+            ),
+            stream=_streamed(format),
+            only=only,
+        )
+
+
+class ReactionTranslationResource(MethodResource):
+    @use_kwargs(ReactionTranslationSearchSchema)
+    @marshal_with(TranslationResponseSchema, code=200)
+    def get(self, source, target, query):
+        # Map reaction identifiers from one namespace to another.
+        return _translation_response(
+            data.reaction_namespace_index,
+            "metanetx.reaction",
+            source,
+            target,
+            query,
+        )
+
+    @use_kwargs(ReactionTranslationLookupSchema, locations=("json",))
+    @marshal_with(TranslationResponseSchema, code=200)
+    def post(self, source, target, query):
+        # Map large batches of reaction identifiers, posted as JSON.
+        return _translation_response(
+            data.reaction_namespace_index,
+            "metanetx.reaction",
+            source,
+            target,
+            query,
+        )
+
+
+class MetaboliteTranslationResource(MethodResource):
+    @use_kwargs(MetaboliteTranslationSearchSchema)
+    @marshal_with(TranslationResponseSchema, code=200)
+    def get(self, source, target, query):
+        # Map metabolite identifiers from one namespace to another.
+        return _translation_response(
+            data.metabolite_namespace_index,
+            "metanetx.chemical",
+            source,
+            target,
+            query,
+        )
+
+    @use_kwargs(MetaboliteTranslationLookupSchema, locations=("json",))
+    @marshal_with(TranslationResponseSchema, code=200)
+    def post(self, source, target, query):
+        # Map large batches of metabolite identifiers, posted as JSON.
+        return _translation_response(
+            data.metabolite_namespace_index,
+            "metanetx.chemical",
+            source,
+            target,
+            query,
+        )
+
+
+def _reactions_response(mnx_ids, normalize, only, stream=False, headers=None):
+    if normalize:
+        return render.normalized_reactions_response(mnx_ids, headers, only=only)
+    return render.reactions_response(mnx_ids, headers, stream=stream, only=only)
+
+
+def _page(mnx_ids, offset, limit, total):
+    """
+    Return a page of ranked results, and its response headers.
+
+    The number of results that can be paged through, at most the search result
+    depth, is given in the `X-Total-Count` header. If the ranking was cut at
+    the depth, leaving out some of the `total` matches, the
+    `X-Search-Truncated` header is set. Unless it's the last page, the cursor
+    of the next page is given in the `X-Next-Cursor` header.
+    """
+    headers = {"X-Total-Count": len(mnx_ids)}
+    if total > len(mnx_ids):
+        headers["X-Search-Truncated"] = "true"
+    if offset + limit < len(mnx_ids):
+        headers["X-Next-Cursor"] = Cursor.encode(offset + limit)
+    return mnx_ids[offset : offset + limit], headers
+
+
+def _translation_response(namespace_index, namespace, source, target, queries):
+    """Return a response translating the queries, see `_translate`."""
+    return jsonify(
+        {
+            "source": source,
+            "target": target,
+            "translations": _translate(
+                namespace_index,
+                namespace,
+                source.lower(),
+                target.lower(),
+                queries,
+            ),
+        }
+    )
+
+
+def _translate(namespace_index, namespace, source, target, queries):
+    """
+    Return the identifiers in the target namespace for each query.
+
+    Queries are identifiers in the source namespace, looked up exactly and once
+    each in the namespace index. The identifiers of their objects in the target
+    namespace are those of their annotation, preceded by their own ID for the
+    MetaNetX namespace of the objects. Unknown queries translate to None.
+    """
+    translations = {}
+    for query in set(queries):
+        obj = namespace_index.get((source, query))
+        if obj is None:
+            translations[query] = None
+            continue
+        identifiers = obj.annotation.get(target, [])
+        if target == namespace:
+            identifiers = [obj.mnx_id] + identifiers
+        translations[query] = identifiers
+    return [translations[query] for query in queries]
+
+
+def _lookup_ids(key_index, namespace_index, queries):
+    """Return the IDs of the objects for the queries, or None if unknown."""
+    return [_lookup_id(key_index, namespace_index, query) for query in queries]
+
+
+def _lookup_unique_ids(key_index, namespace_index, queries):
+    """Return the IDs of the objects for the queries, looking up each once."""
+    keys = [_lookup_key(query) for query in queries]
+    mnx_ids = {
+        key: _lookup_id(key_index, namespace_index, key) for key in set(keys)
+    }
+    return [mnx_ids[key] for key in keys]
+
+
+def _lookup_key(query):
+    """
+    Return the query normalized to what `_lookup_id` matches it by.
+
+    Identifiers qualified by a namespace are case sensitive, only their
+    namespace isn't; other queries are case insensitive.
+    """
+    namespace, _, identifier = query.partition(":")
+    if identifier:
+        return f"{namespace.lower()}:{identifier}"
+    return query.lower()
+
+
+def _lookup_id(key_index, namespace_index, query):
+    """
+    Return the ID of the object matching the query, or None if unknown.
+
+    Queries qualified by a namespace, such as "bigg.metabolite:glc__D", match
+    exactly that identifier. Other queries, and qualified ones that don't
+    match, are looked up case insensitively among all IDs, names and
+    identifiers.
+    """
+    namespace, _, identifier = query.partition(":")
+    obj = None
+    if identifier:
+        obj = namespace_index.get((namespace.lower(), identifier))
+    if obj is None:
+        obj = key_index.get(query.lower())
+    return None if obj is None else obj.mnx_id
+
+
+def _streamed(format):
+    """Return whether to stream a batch as newline-delimited JSON."""
+    if format:
+        return format == "ndjson"
+    return (
+        request.accept_mimetypes.best_match(
+            [current_app.config["JSONIFY_MIMETYPE"], render.NDJSON_MIMETYPE]
+        )
+        == render.NDJSON_MIMETYPE
+    )
@@ -15,16 +15,179 @@
 
 """Marshmallow schemas for marshalling the API endpoints."""
 
-from marshmallow import Schema, fields
+import base64
+import json
+
+from marshmallow import (
+    Schema,
+    ValidationError,
+    class_registry,
+    fields,
+    validate,
+    validates,
+    validates_schema,
+)
 from webargs.fields import DelimitedList
 
+from .namespaces import METABOLITE_NAMESPACES, REACTION_NAMESPACES
+
 
 class SearchSchema(Schema):
     query = fields.Str(required=True)
 
 
+class Cursor(fields.Field):
+    """Opaque pagination cursor, holding the offset of the next page."""
+
+    @staticmethod
+    def encode(offset):
+        return (
+            base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode())
+            .rstrip(b"=")
+            .decode()
+        )
+
+    def _serialize(self, value, attr, obj, **kwargs):
+        return None if value is None else self.encode(value)
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        try:
+            padded = value + "=" * (-len(value) % 4)
+            offset = json.loads(base64.urlsafe_b64decode(padded))["offset"]
+        except (TypeError, ValueError, KeyError):
+            raise ValidationError("Invalid cursor.")
+        if type(offset) is not int or offset < 0:
+            raise ValidationError("Invalid cursor.")
+        return offset
+
+
+class PageMixin:
+    # The number of results per page, and the cursor of a page as returned in
+    # the `X-Next-Cursor` header of the previous one.
+    limit = fields.Int(missing=30, validate=validate.Range(min=1, max=100))
+    cursor = Cursor(missing=0)
+
+
+class FieldsMixin:
+    # Limit responses to the given fields of `response_schema`, including
+    # nested ones such as "reaction.name".
+    only = DelimitedList(fields.Str(), data_key="fields")
+
+    @validates("only")
+    def validate_only(self, value):
+        try:
+            schema = class_registry.get_class(self.response_schema)(only=value)
+            # Nested fields are only validated once their schema is created.
+            for field in schema.fields.values():
+                if isinstance(field, fields.Nested):
+                    field.schema
+        except ValueError as error:
+            raise ValidationError(str(error))
+
+
+class NormalizeMixin:
+    # List each referenced metabolite and compartment once, in lookup tables
+    # keyed by ID, rather than with every reaction.
+    normalize = fields.Bool(missing=False)
+
+    @validates_schema
+    def validate_normalize(self, data, **kwargs):
+        if data["normalize"] and data.get("format") == "ndjson":
+            raise ValidationError("Normalized responses can't be streamed.")
+
+
+class ReactionSearchSchema(
+    PageMixin, NormalizeMixin, FieldsMixin, SearchSchema
+):
+    response_schema = "ReactionResponseSchema"
+
+
+class MetaboliteSearchSchema(PageMixin, FieldsMixin, SearchSchema):
+    response_schema = "MetaboliteSchema"
+
+    mode = fields.Str(
+        missing="substring", validate=validate.OneOf(["substring", "fuzzy"])
+    )
+
+
 class BatchSearchSchema(Schema):
     query = DelimitedList(fields.Str(), required=True)
+    # Newline-delimited JSON is streamed, one result per query.
+    format = fields.Str(validate=validate.OneOf(["json", "ndjson"]))
+
+
+class BatchLookupSchema(Schema):
+    query = fields.List(fields.Str(), required=True)
+    format = fields.Str(validate=validate.OneOf(["json", "ndjson"]))
+
+
+class ReactionBatchSearchSchema(NormalizeMixin, FieldsMixin, BatchSearchSchema):
+    response_schema = "ReactionResponseSchema"
+
+
+class ReactionBatchLookupSchema(NormalizeMixin, FieldsMixin, BatchLookupSchema):
+    response_schema = "ReactionResponseSchema"
+
+
+class MetaboliteBatchSearchSchema(FieldsMixin, BatchSearchSchema):
+    response_schema = "MetaboliteSchema"
+
+
+class MetaboliteBatchLookupSchema(FieldsMixin, BatchLookupSchema):
+    response_schema = "MetaboliteSchema"
+
+
+class TranslationSchema(Schema):
+    # Translate identifiers from the source namespace into the target one,
+    # such as from "bigg.metabolite" into "kegg.compound".
+    source = fields.Str(required=True)
+    target = fields.Str(required=True)
+    # The known namespaces of the translated objects, case insensitively.
+    namespaces = frozenset()
+
+    @validates("source")
+    def validate_source(self, value):
+        self._validate_namespace(value)
+
+    @validates("target")
+    def validate_target(self, value):
+        self._validate_namespace(value)
+
+    def _validate_namespace(self, value):
+        if value.lower() not in self.namespaces:
+            raise ValidationError(f"Unknown namespace: {value}")
+
+
+class TranslationSearchSchema(TranslationSchema):
+    query = DelimitedList(fields.Str(), required=True)
+
+
+class TranslationLookupSchema(TranslationSchema):
+    query = fields.List(fields.Str(), required=True)
+
+
+class ReactionTranslationSearchSchema(TranslationSearchSchema):
+    namespaces = REACTION_NAMESPACES
+
+
+class ReactionTranslationLookupSchema(TranslationLookupSchema):
+    namespaces = REACTION_NAMESPACES
+
+
+class MetaboliteTranslationSearchSchema(TranslationSearchSchema):
+    namespaces = METABOLITE_NAMESPACES
+
+
+class MetaboliteTranslationLookupSchema(TranslationLookupSchema):
+    namespaces = METABOLITE_NAMESPACES
+
+
+class TranslationResponseSchema(Schema):
+    source = fields.Str()
+    target = fields.Str()
+    # The identifiers in the target namespace per query, or None for unknown
+    # identifiers in the source namespace.
+    translations = fields.List(fields.List(fields.Str(), allow_none=True))
 
 
 class CompartmentSchema(Schema):
@@ -59,3 +222,13 @@ class ReactionResponseSchema(Schema):
     reaction = fields.Nested(ReactionSchema)
     metabolites = fields.Nested(MetaboliteSchema, many=True)
     compartments = fields.Nested(CompartmentSchema, many=True)
+
+
+class NormalizedReactionResponseSchema(Schema):
+    reactions = fields.Nested(ReactionSchema, many=True)
+    metabolites = fields.Dict(
+        keys=fields.Str(), values=fields.Nested(MetaboliteSchema)
+    )
+    compartments = fields.Dict(
+        keys=fields.Str(), values=fields.Nested(CompartmentSchema)
+    )
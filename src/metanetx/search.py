@@ -0,0 +1,215 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rank MetaNetX objects against search queries."""
+
+import heapq
+
+from fuzzywuzzy import fuzz
+
+from . import data
+from .index import Deadline
+
+
+ENGINES = ("scan", "ngram", "columnar")
+
+# The number of reactions scored between checks of a search deadline.
+CHUNK_SIZE = 128
+
+
+def search_reactions(
+    query, limit, engine="ngram", shortlist=2000, deadline=None
+):
+    """
+    Return the reactions best matching the query, and the number of matches.
+
+    Reactions are ranked best match first, and those scoring above 0 match the
+    query. Only matches among the scored candidates are counted, see `top_k`.
+
+    Parameters
+    ----------
+    query : string
+        The search string.
+    limit : int
+        The maximum number of reactions to return.
+    engine : string
+        "scan" scores every reaction in the data store. "ngram" only scores the
+        reactions sharing the most n-grams with the query, which is much faster
+        but might rank a few poorly matching reactions differently. "columnar"
+        scores every reaction in bulk, with a partial ratio on names which is
+        at least as high as that of `Reaction.match`.
+    shortlist : int
+        The number of candidates the "ngram" engine scores.
+    deadline : Deadline, optional
+        Score the candidates in chunks, yielding to other greenlets between
+        them, and rank the ones scored so far once the deadline expires.
+
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown search engine '{engine}'")
+    # An empty query only matches empty strings, which the columnar table
+    # doesn't hold, so leave that to the reference implementation.
+    if engine == "columnar" and query:
+        return data.reaction_score_table.top_k(query, limit, deadline)
+    index = data.reaction_ngram_index
+    candidates = data.reactions.values()
+    # Queries shorter than a single n-gram can't be shortlisted meaningfully.
+    if engine == "ngram" and len(query) >= index.n:
+        shortlisted = index.shortlist(query, shortlist)
+        # Too few candidates share an n-gram with the query to fill the
+        # results, so the remaining ones have to be found by a full scan.
+        if len(shortlisted) >= limit:
+            candidates = shortlisted
+    return top_k(candidates, query, limit, deadline)
+
+
+def rank_reactions(query, limit, budget=None, **kwargs):
+    """
+    Return the IDs and number of best matching reactions, and if time ran out.
+
+    Searches like `search_reactions` within a budget in seconds, for results
+    which are cached or returned from the search pool.
+    """
+    deadline = Deadline(budget)
+    reactions, total = search_reactions(
+        query, limit, deadline=deadline, **kwargs
+    )
+    return [reaction.mnx_id for reaction in reactions], total, deadline.expired
+
+
+def top_k(reactions, query, k, deadline=None):
+    """
+    Return the `k` reactions best matching the query, and the number of matches.
+
+    The result is identical to sorting all reactions by `Reaction.match` in
+    descending order and keeping the first `k`, including the order of equally
+    scored reactions, which remains their order in `reactions`. However, only
+    the current `k` best reactions are kept in a heap, and strings which can't
+    possibly score higher than the worst of them are never compared to the
+    query. With a deadline, the search stops at the first expired check, every
+    `CHUNK_SIZE` reactions, and only the reactions scored so far are counted
+    as matches, which are those scoring above 0. Once `k` perfect matches and
+    any other match are found, the remaining reactions aren't scored, and the
+    number of matches only tells that there are more than `k`.
+    """
+    if k <= 0:
+        return [], 0
+    # The heap root is the worst result so far: the lowest score and, among
+    # equal scores, the last one found.
+    heap = []
+    matches = 0
+    for position, reaction in enumerate(reactions):
+        if (
+            deadline is not None
+            and position
+            and position % CHUNK_SIZE == 0
+            and deadline.checkpoint()
+        ):
+            break
+        if len(heap) < k:
+            score = _match_above(reaction, query, -1)
+            matches += score > 0
+            heapq.heappush(heap, (score, -position, reaction))
+            continue
+        threshold = heap[0][0]
+        if threshold == 100 and matches > k:
+            # Later reactions can at most tie with the perfect matches found so
+            # far, and ties are won by the earlier reaction. Since more than `k`
+            # matches were counted, the ranking is known to be truncated.
+            break
+        score = _match_above(reaction, query, threshold)
+        matches += score > 0
+        if score > threshold:
+            heapq.heapreplace(heap, (score, -position, reaction))
+    return [reaction for _, _, reaction in sorted(heap, reverse=True)], matches
+
+
+def _match_above(reaction, query, threshold):
+    """
+    Match the query against a reaction, if it can score above the threshold.
+
+    Returns `reaction.match(query)` if that exceeds the threshold, otherwise any
+    score not exceeding the threshold, which is above 0 if the match is. Any
+    string whose length alone rules out a ratio above both the threshold and
+    the best score so far is skipped, once the score is above 0.
+    """
+    # There is no cheap bound for the partial ratio, so always compute it.
+    best = fuzz.partial_ratio(query, reaction.name) if reaction.name else 0
+    strings = [reaction.mnx_id, reaction.ec]
+    strings.extend(
+        identifier
+        for identifiers in reaction.annotation.values()
+        for identifier in identifiers
+    )
+    for string in strings:
+        if not best or _ratio_bound(query, string) > max(best, threshold):
+            best = max(best, fuzz.ratio(query, string))
+    return best
+
+
+def _ratio_bound(query, string):
+    """Return an upper bound of `fuzz.ratio` from the string lengths alone."""
+    if query == string:
+        return 100
+    elif not query or not string:
+        return 0
+    # Every edit needed to equalize the lengths reduces the ratio, which is
+    # then rounded to the nearest integer; hence the integer ceiling.
+    return 200 * min(len(query), len(string)) // (len(query) + len(string)) + 1
+
+
+def search_metabolites(query, limit, mode="substring", deadline=None):
+    """
+    Return the metabolites matching the query, and the total number of matches.
+
+    Parameters
+    ----------
+    query : string
+        The search string.
+    limit : int
+        The maximum number of metabolites to return.
+    mode : string
+        "substring" returns the first metabolites with an ID or name containing
+        the query, case insensitively, in the order of the data store. "fuzzy"
+        tolerates typos and ranks the metabolites by the edit distance of their
+        ID, name or a word in their name.
+    deadline : Deadline, optional
+        Verify the candidates of a "fuzzy" search in chunks, yielding to other
+        greenlets between them, and rank the matches found so far once the
+        deadline expires.
+
+    """
+    if mode == "fuzzy":
+        return data.metabolite_deletion_index.find(query, limit, deadline)
+    elif mode == "substring":
+        return data.metabolite_substring_index.find(query, limit)
+    else:
+        raise ValueError(f"Unknown search mode '{mode}'")
+
+
+def rank_metabolites(query, limit, mode="substring", budget=None):
+    """
+    Return the IDs and number of matching metabolites, and if time ran out.
+
+    Searches like `search_metabolites` within a budget in seconds, for results
+    which are cached or returned from the search pool.
+    """
+    deadline = Deadline(budget)
+    metabolites, total = search_metabolites(query, limit, mode, deadline)
+    return (
+        [metabolite.mnx_id for metabolite in metabolites],
+        total,
+        deadline.expired,
+    )
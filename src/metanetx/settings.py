@@ -53,6 +53,91 @@ class Default:
         self.APISPEC_SWAGGER_UI_URL = "/"
         self.CORS_ORIGINS = os.environ["ALLOWED_ORIGINS"].split(",")
         self.SENTRY_DSN = os.environ.get("SENTRY_DSN")
+        # Path of a binary snapshot of the parsed data, which is restored
+        # instead of parsing the source files if it's up to date.
+        self.DATA_SNAPSHOT = os.environ.get(
+            "DATA_SNAPSHOT", "data/snapshot.pickle"
+        )
+        # Path of the packed, read-only data store shared by all workers, which
+        # is written on startup if it's outdated. Disabled if unset.
+        self.DATA_STORE = os.environ.get("DATA_STORE")
+        # Token authorizing `POST /admin/reload` requests, as a bearer token.
+        # The endpoint is disabled if unset.
+        self.ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+        # The number of processes to parse the source files with, up to three.
+        self.DATA_LOADING_PROCESSES = int(
+            os.environ.get("DATA_LOADING_PROCESSES", 1)
+        )
+        # Load the data store in the background, serving lookups and then
+        # searches as soon as their data is loaded. Gunicorn workers can only
+        # be forked once the app is loaded though, so this is meant for
+        # workers loading the app themselves.
+        self.DATA_LOADING_BACKGROUND = (
+            os.environ.get("DATA_LOADING_BACKGROUND", "false").lower() == "true"
+        )
+        # Parse the annotations of reactions and metabolites, and the
+        # equations of reactions, only once they're accessed, which loads the
+        # data faster into less memory. Annotations are then read from a file
+        # on first access, which slows down the "ngram" and "scan" reaction
+        # search engines; the "columnar" engine doesn't access them.
+        self.DATA_LOADING_LAZY = (
+            os.environ.get("DATA_LOADING_LAZY", "false").lower() == "true"
+        )
+        # The directory of the anonymous file holding the annotations of lazy
+        # datasets, by default the temporary directory, since the data
+        # directory may be read-only.
+        self.LAZY_SIDECAR_DIRECTORY = os.environ.get("LAZY_SIDECAR_DIRECTORY")
+        # The number of lazily parsed annotations and equations kept per
+        # worker.
+        self.LAZY_CACHE_SIZE = int(os.environ.get("LAZY_CACHE_SIZE", 16384))
+        # Either "ngram" to score only a shortlist of candidates sharing the
+        # most n-grams with the query, "scan" to score every reaction, or
+        # "columnar" to score every reaction in bulk.
+        self.REACTION_SEARCH_ENGINE = os.environ.get(
+            "REACTION_SEARCH_ENGINE", "ngram"
+        )
+        self.REACTION_SEARCH_SHORTLIST = int(
+            os.environ.get("REACTION_SEARCH_SHORTLIST", 2000)
+        )
+        # Seconds after which reaction searches rank the reactions scored so
+        # far, flagging the results as partial, or None to always score all
+        # candidates. Searches yield to other greenlets regularly either way.
+        budget = os.environ.get("REACTION_SEARCH_BUDGET")
+        self.REACTION_SEARCH_BUDGET = float(budget) if budget else None
+        # The number of ranked results computed and cached per search query,
+        # which pages are sliced from. The shared cache backend only keeps
+        # results fitting into its 4 KiB slots, about 250 IDs.
+        self.SEARCH_RESULT_DEPTH = int(
+            os.environ.get("SEARCH_RESULT_DEPTH", 200)
+        )
+        # The number of processes each worker forks to run searches in, 0 to
+        # search in the worker itself.
+        self.SEARCH_PROCESSES = int(os.environ.get("SEARCH_PROCESSES", 0))
+        # The number of results cached per resource, 0 to disable caching.
+        self.SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", 1024))
+        # The maximum size of request bodies, in bytes, both as sent and
+        # decompressed. Flask applies it to forms, and `GzipRequest` to any
+        # request.
+        self.MAX_REQUEST_BODY_SIZE = int(
+            os.environ.get("MAX_REQUEST_BODY_SIZE", 64 * 2 ** 20)
+        )
+        self.MAX_CONTENT_LENGTH = self.MAX_REQUEST_BODY_SIZE
+        # The number of rendered reactions and metabolites memoized per worker.
+        self.RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", 16384))
+        # Either "local" to cache results per worker, or "shared" to share them
+        # between all workers on a host through memory-mapped files in the
+        # given directory.
+        self.SEARCH_CACHE_BACKEND = os.environ.get(
+            "SEARCH_CACHE_BACKEND", "local"
+        )
+        self.SEARCH_CACHE_DIRECTORY = os.environ.get(
+            "SEARCH_CACHE_DIRECTORY", "/dev/shm"
+        )
+        # Seconds after which fuzzy metabolite searches rank the matches found
+        # so far.
+        self.METABOLITE_FUZZY_SEARCH_BUDGET = float(
+            os.environ.get("METABOLITE_FUZZY_SEARCH_BUDGET", 0.1)
+        )
         self.SENTRY_CONFIG = {
             "ignore_exceptions": [
                 werkzeug.exceptions.BadRequest,
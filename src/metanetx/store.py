@@ -0,0 +1,512 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Read-only data store packed into a single memory-mapped file.
+
+Python objects are written to whenever they're used, by reference counting and
+the cyclic garbage collector, so the memory pages holding the data store loaded
+before gunicorn forks its workers are soon copied into every worker. The packed
+store instead holds all compartments, reactions and metabolites in one buffer
+of strings and integer arrays, without any pointers, which all processes
+mapping the file share. Records are read through lightweight proxies of the
+data classes, which are only created on access.
+"""
+
+import copy
+import json
+import logging
+import mmap
+import operator
+import os
+import struct
+from array import array
+from collections.abc import Mapping, Sequence
+
+from .data import BaseCompartment, BaseMetabolite, BaseReaction
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MNXSTORE"
+# Increment whenever the file layout changes, to invalidate old stores.
+VERSION = 2
+# The magic, version and the length of the JSON table of contents.
+HEADER = struct.Struct("<8sII")
+# String ID of missing (`None`) strings.
+NONE = 0xFFFFFFFF
+# The indexes whose entries are stored, and the table of the entries.
+INDEXES = (
+    ("reaction_ngram_index", "reactions"),
+    ("reaction_score_table", "reactions"),
+    ("metabolite_substring_index", "metabolites"),
+    ("metabolite_deletion_index", "metabolites"),
+)
+
+
+def write_store(path, checksum, dataset):
+    """
+    Pack a dataset into a file.
+
+    Parameters
+    ----------
+    path : string
+        The file to write, atomically replacing any existing one.
+    checksum : string
+        The checksum of the source files the dataset was loaded from.
+    dataset : metanetx.data.Dataset
+        The dataset to pack.
+
+    """
+    writer = _StoreWriter()
+    for name, record in (
+        ("compartments", _compartment_record),
+        ("reactions", _reaction_record),
+        ("metabolites", _metabolite_record),
+    ):
+        writer.add_table(name, getattr(dataset, name), record)
+    writer.add_key_index(
+        "reaction_key_index", "reactions", dataset.reaction_key_index
+    )
+    writer.add_key_index(
+        "metabolite_key_index", "metabolites", dataset.metabolite_key_index
+    )
+    for name, table in (
+        ("reaction_namespace_index", "reactions"),
+        ("metabolite_namespace_index", "metabolites"),
+    ):
+        # Namespaces never contain a colon, so the joined keys are unambiguous.
+        writer.add_key_index(
+            name,
+            table,
+            {
+                f"{namespace}:{identifier}": obj
+                for (namespace, identifier), obj in getattr(
+                    dataset, name
+                ).items()
+            },
+        )
+    for name, table in INDEXES:
+        writer.add_entries(name, table, getattr(dataset, name).entries)
+    writer.write(path, checksum)
+    logger.info(f"Wrote the packed data store to {path}")
+
+
+def open_store(path, checksum):
+    """Return the packed store at path, or None if missing or outdated."""
+    try:
+        file_ = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with file_:
+        magic, version, length = HEADER.unpack(file_.read(HEADER.size))
+        if (magic, version) != (MAGIC, VERSION):
+            return None
+        contents = json.loads(file_.read(length))
+        if contents["checksum"] != checksum:
+            return None
+        buffer = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+    return PackedStore(buffer, HEADER.size + length, contents["sections"])
+
+
+def install(store, dataset):
+    """Replace the objects of a dataset by views of the packed store."""
+    dataset.compartments = store.tables["compartments"]
+    dataset.reactions = store.tables["reactions"]
+    dataset.metabolites = store.tables["metabolites"]
+    dataset.reaction_key_index = store.key_index(
+        "reaction_key_index", "reactions"
+    )
+    dataset.metabolite_key_index = store.key_index(
+        "metabolite_key_index", "metabolites"
+    )
+    dataset.reaction_namespace_index = store.namespace_index(
+        "reaction_namespace_index", "reactions"
+    )
+    dataset.metabolite_namespace_index = store.namespace_index(
+        "metabolite_namespace_index", "metabolites"
+    )
+    for name, table in INDEXES:
+        # Copied, as the index may still be in use by another dataset.
+        index = copy.copy(getattr(dataset, name))
+        index.entries = store.entries(name, table)
+        setattr(dataset, name, index)
+
+
+class PackedStore:
+    """
+    The sections of a packed store file.
+
+    Strings are numbered; their UTF-8 encodings are concatenated in the
+    `strings` section and delimited by the `string_offsets` section. Each table
+    has a `records` section with a fixed number of integer columns per record,
+    referring to strings, or to runs of the shared `annotations` (pairs of
+    namespace and identifier) and `species` (pairs of metabolite and
+    compartment, with the coefficient at the same index in `coefficients`).
+    Mappings are stored as pairs of string and record position, sorted by
+    string.
+    """
+
+    def __init__(self, buffer, start, sections):
+        self._buffer = buffer
+        view = memoryview(buffer)[start:]
+        self._sections = {
+            name: view[offset : offset + length].cast(format_)
+            for name, (offset, length, format_) in sections.items()
+        }
+        self._strings = self._sections["strings"]
+        self._string_offsets = self._sections["string_offsets"]
+        self.tables = {
+            name: PackedTable(self, name, proxy)
+            for name, proxy in (
+                ("compartments", PackedCompartment),
+                ("reactions", PackedReaction),
+                ("metabolites", PackedMetabolite),
+            )
+        }
+
+    def section(self, name):
+        return self._sections[name]
+
+    def string(self, string_id):
+        if string_id == NONE:
+            return None
+        return str(
+            self._strings[
+                self._string_offsets[string_id] : self._string_offsets[
+                    string_id + 1
+                ]
+            ],
+            "utf-8",
+        )
+
+    def key_index(self, name, table):
+        return PackedMapping(self, self.section(name), self.tables[table])
+
+    def namespace_index(self, name, table):
+        return PackedNamespaceMapping(
+            self, self.section(name), self.tables[table]
+        )
+
+    def entries(self, name, table):
+        return RecordSequence(self.tables[table], self.section(name))
+
+
+class RecordSequence(Sequence):
+    """Read-only sequence of the records of a table at given positions."""
+
+    def __init__(self, table, positions=None):
+        self._table = table
+        self._positions = positions
+
+    def __len__(self):
+        if self._positions is None:
+            return len(self._table)
+        return len(self._positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = operator.index(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("record index out of range")
+        if self._positions is not None:
+            index = self._positions[index]
+        return self._table.record(index)
+
+
+class PackedMapping(Mapping):
+    """Read-only mapping from strings to the records of a table."""
+
+    def __init__(self, store, pairs, table):
+        self._store = store
+        self._pairs = pairs
+        self._table = table
+
+    def __len__(self):
+        return len(self._pairs) // 2
+
+    def __iter__(self):
+        for index in range(0, len(self._pairs), 2):
+            yield self._store.string(self._pairs[index])
+
+    def __getitem__(self, key):
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._store.string(self._pairs[2 * middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self) and self._store.string(self._pairs[2 * low]) == key:
+            return self._table.record(self._pairs[2 * low + 1])
+        raise KeyError(key)
+
+
+class PackedNamespaceMapping(PackedMapping):
+    """Read-only mapping from pairs of namespace and identifier to records."""
+
+    def __iter__(self):
+        for key in super().__iter__():
+            yield tuple(key.split(":", 1))
+
+    def __getitem__(self, key):
+        namespace, identifier = key
+        try:
+            return super().__getitem__(f"{namespace}:{identifier}")
+        except KeyError:
+            raise KeyError(key) from None
+
+
+class PackedTable(PackedMapping):
+    """Read-only mapping of MetaNetX IDs to records, in insertion order."""
+
+    def __init__(self, store, name, proxy):
+        super().__init__(store, store.section(f"{name}.ids"), self)
+        self._records = store.section(f"{name}.records")
+        self._width = len(proxy.columns)
+        self._proxy = proxy
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self._store.string(self.column(position, 0))
+
+    def column(self, position, column):
+        return self._records[position * self._width + column]
+
+    def record(self, position):
+        return self._proxy(self, position)
+
+    def values(self):
+        return RecordSequence(self)
+
+    def items(self):
+        return ((record.mnx_id, record) for record in self.values())
+
+
+def _string_column(column):
+    def get(self):
+        return self._store.string(self._table.column(self._position, column))
+
+    return property(get)
+
+
+class _PackedRecord:
+    """Mixin reading the attributes of a data class from a packed table."""
+
+    __slots__ = ()
+
+    def __init__(self, table, position):
+        self._table = table
+        self._store = table._store
+        self._position = position
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.mnx_id}>"
+
+    def _run(self, start):
+        start, count = (
+            self._table.column(self._position, start),
+            self._table.column(self._position, start + 1),
+        )
+        return start, start + count
+
+    @property
+    def annotation(self):
+        start, end = self._run(self.columns.index("annotation_start"))
+        pairs = self._store.section("annotations")
+        annotation = {}
+        for index in range(2 * start, 2 * end, 2):
+            annotation.setdefault(self._store.string(pairs[index]), []).append(
+                self._store.string(pairs[index + 1])
+            )
+        return annotation
+
+
+class PackedCompartment(_PackedRecord, BaseCompartment):
+    __slots__ = ("_table", "_store", "_position")
+
+    columns = ("mnx_id", "name", "xref", "annotation_start", "annotation_count")
+    mnx_id = _string_column(0)
+    name = _string_column(1)
+    xref = _string_column(2)
+
+
+class PackedReaction(_PackedRecord, BaseReaction):
+    __slots__ = ("_table", "_store", "_position")
+
+    columns = (
+        "mnx_id",
+        "name",
+        "equation_string",
+        "ec",
+        "species_start",
+        "species_count",
+        "annotation_start",
+        "annotation_count",
+    )
+    mnx_id = _string_column(0)
+    name = _string_column(1)
+    equation_string = _string_column(2)
+    ec = _string_column(3)
+
+    @property
+    def _species(self):
+        start, end = self._run(4)
+        species = self._store.section("species")
+        return tuple(
+            self._store.string(string_id)
+            for string_id in species[2 * start : 2 * end]
+        )
+
+    @property
+    def _coefficients(self):
+        start, end = self._run(4)
+        return self._store.section("coefficients")[start:end].tolist()
+
+
+class PackedMetabolite(_PackedRecord, BaseMetabolite):
+    __slots__ = ("_table", "_store", "_position")
+
+    columns = (
+        "mnx_id",
+        "name",
+        "formula",
+        "annotation_start",
+        "annotation_count",
+    )
+    mnx_id = _string_column(0)
+    name = _string_column(1)
+    formula = _string_column(2)
+
+
+def _compartment_record(writer, compartment):
+    return [
+        writer.string(compartment.mnx_id),
+        writer.string(compartment.name),
+        writer.string(compartment.xref),
+    ] + writer.annotation(compartment.annotation)
+
+
+def _reaction_record(writer, reaction):
+    start = len(writer.coefficients)
+    writer.species.extend(writer.string(s) for s in reaction._species)
+    writer.coefficients.extend(reaction._coefficients)
+    return [
+        writer.string(reaction.mnx_id),
+        writer.string(reaction.name),
+        writer.string(reaction.equation_string),
+        writer.string(reaction.ec),
+        start,
+        len(reaction._coefficients),
+    ] + writer.annotation(reaction.annotation)
+
+
+def _metabolite_record(writer, metabolite):
+    return [
+        writer.string(metabolite.mnx_id),
+        writer.string(metabolite.name),
+        writer.string(metabolite.formula),
+    ] + writer.annotation(metabolite.annotation)
+
+
+class _StoreWriter:
+    def __init__(self):
+        self.string_ids = {}
+        self.annotations = array("I")
+        self.species = array("I")
+        self.coefficients = array("d")
+        self.sections = {}
+        self.positions = {}
+
+    def string(self, string):
+        if string is None:
+            return NONE
+        return self.string_ids.setdefault(string, len(self.string_ids))
+
+    def annotation(self, annotation):
+        start = len(self.annotations) // 2
+        for namespace, identifiers in annotation.items():
+            for identifier in identifiers:
+                self.annotations.append(self.string(namespace))
+                self.annotations.append(self.string(identifier))
+        return [start, len(self.annotations) // 2 - start]
+
+    def add_table(self, name, objects, record):
+        records = array("I")
+        self.positions[name] = {}
+        for position, obj in enumerate(objects.values()):
+            records.extend(record(self, obj))
+            self.positions[name][obj.mnx_id] = position
+        self.sections[f"{name}.records"] = records
+        self.sections[f"{name}.ids"] = self._sorted_pairs(
+            (obj.mnx_id, position)
+            for obj, position in zip(objects.values(), range(len(objects)))
+        )
+
+    def add_key_index(self, name, table, key_index):
+        positions = self.positions[table]
+        self.sections[name] = self._sorted_pairs(
+            (key, positions[obj.mnx_id]) for key, obj in key_index.items()
+        )
+
+    def add_entries(self, name, table, entries):
+        positions = self.positions[table]
+        self.sections[name] = array(
+            "I", (positions[entry.mnx_id] for entry in entries)
+        )
+
+    def _sorted_pairs(self, pairs):
+        sorted_pairs = array("I")
+        for key, position in sorted(pairs):
+            sorted_pairs.append(self.string(key))
+            sorted_pairs.append(position)
+        return sorted_pairs
+
+    def write(self, path, checksum):
+        offsets = array("Q", [0])
+        encoded = bytearray()
+        for string in self.string_ids:
+            encoded += string.encode("utf-8")
+            offsets.append(len(encoded))
+        self.sections["strings"] = encoded
+        self.sections["string_offsets"] = offsets
+        self.sections["annotations"] = self.annotations
+        self.sections["species"] = self.species
+        self.sections["coefficients"] = self.coefficients
+
+        # Sections are laid out after the table of contents, 8 byte aligned.
+        table = {}
+        offset = 0
+        for name, section in self.sections.items():
+            length = len(section) * getattr(section, "itemsize", 1)
+            table[name] = (offset, length, getattr(section, "typecode", "B"))
+            offset += -(-length // 8) * 8
+        contents = json.dumps({"checksum": checksum, "sections": table})
+        contents = contents.encode("utf-8")
+        padded_length = -(-(HEADER.size + len(contents)) // 8) * 8
+        contents = contents.ljust(padded_length - HEADER.size)
+
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as file_:
+            file_.write(HEADER.pack(MAGIC, VERSION, len(contents)))
+            file_.write(contents)
+            for section in self.sections.values():
+                section = bytes(section)
+                file_.write(section)
+                file_.write(bytes(-len(section) % 8))
+        os.replace(temporary_path, path)
@@ -31,5 +31,6 @@ def app():
 @pytest.fixture(scope="session")
 def client(app):
     """Provide a Flask test client to be used by almost all test cases."""
-    with app.test_client() as client:
-        yield client
+    # Not preserving the request context, which would keep the dataset of the
+    # last request pinned.
+    return app.test_client()
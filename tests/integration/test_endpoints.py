@@ -21,3 +21,12 @@ def test_docs(client):
     resp = client.get("/")
     assert resp.status_code == 200
     assert resp.content_type == "text/html; charset=utf-8"
+
+
+def test_normalized_docs(client):
+    """Expect the normalized reaction responses to be documented."""
+    spec = client.get("/swagger/").get_json()
+    assert "NormalizedReactionResponse" in spec["definitions"]
+    for path in ("/reactions", "/reactions/batch"):
+        response = spec["paths"][path]["get"]["responses"]["200"]
+        assert "NormalizedReactionResponse" in response["description"]
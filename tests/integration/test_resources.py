@@ -0,0 +1,578 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test expected functioning of the API resources."""
+
+import gzip
+import json
+import threading
+
+import pytest
+from werkzeug.exceptions import Conflict, Forbidden
+
+from metanetx import cache, data, namespaces, parser, pool, resources, search
+from metanetx.cache import LRUCache
+from metanetx.schemas import (
+    MetaboliteSchema,
+    NormalizedReactionResponseSchema,
+    ReactionResponseSchema,
+)
+from metanetx.store import INDEXES
+
+
+def test_reaction_search(client):
+    reaction = next(iter(data.reactions.values()))
+    resp = client.get(f"/reactions?query={reaction.mnx_id}")
+    assert resp.status_code == 200
+    results = resp.get_json()
+    assert len(results) == 30
+    assert results[0]["reaction"]["mnx_id"] == reaction.mnx_id
+
+
+def test_reaction_search_engines(app):
+    """Expect the n-gram shortlist to find the same best matches."""
+    for query in ("pyruvate kinase", "glucose", "2.7.1.1"):
+        expected, _ = search.search_reactions(query, 30, engine="scan")
+        results, _ = search.search_reactions(query, 30, engine="ngram")
+        assert [r.match(query) for r in results] == [
+            r.match(query) for r in expected
+        ]
+
+
+def test_partial_reaction_search(app, client):
+    """Expect searches running out of time to be flagged and not cached."""
+    app.config["REACTION_SEARCH_BUDGET"] = 0
+    try:
+        for _ in range(2):
+            resp = client.get("/reactions?query=partial&limit=5")
+            assert resp.status_code == 200
+            assert resp.headers["X-Search-Partial"] == "true"
+            assert len(resp.get_json()) == 5
+    finally:
+        app.config["REACTION_SEARCH_BUDGET"] = None
+    resp = client.get("/reactions?query=partial&limit=5")
+    assert "X-Search-Partial" not in resp.headers
+
+
+def test_search_pool(client, monkeypatch):
+    """Expect searches in the pool to return the same results."""
+    urls = ("/reactions?query=glucose", "/metabolites?query=gluco&mode=fuzzy")
+    expected = [client.get(url).get_json() for url in urls]
+    search_pool = pool.SearchPool(2)
+    monkeypatch.setattr(pool, "pool", search_pool)
+    pool.start()
+    monkeypatch.setitem(cache.caches, "reactions", LRUCache(0))
+    monkeypatch.setitem(cache.caches, "metabolites", LRUCache(0))
+    try:
+        assert [client.get(url).get_json() for url in urls] == expected
+    finally:
+        search_pool.close()
+
+
+def test_metabolite_search(client):
+    resp = client.get("/metabolites?query=mnxm1")
+    assert resp.status_code == 200
+    expected = [m for m in data.metabolites.values() if m.match("mnxm1")]
+    assert [m["mnx_id"] for m in resp.get_json()] == [
+        m.mnx_id for m in expected[:30]
+    ]
+    # The ranking is cut at the search result depth.
+    assert len(expected) > 200
+    assert resp.headers["X-Total-Count"] == "200"
+    assert resp.headers["X-Search-Truncated"] == "true"
+    resp = client.get(f"/metabolites?query={expected[0].name}")
+    assert int(resp.headers["X-Total-Count"]) == len(resp.get_json())
+    assert "X-Search-Truncated" not in resp.headers
+
+
+def test_metabolite_fuzzy_search(client):
+    metabolite = next(iter(data.metabolites.values()))
+    typo = metabolite.mnx_id[:-1] + "X"
+    resp = client.get(f"/metabolites?query={typo}&mode=fuzzy")
+    assert resp.status_code == 200
+    assert metabolite.mnx_id in [m["mnx_id"] for m in resp.get_json()]
+    assert "X-Search-Partial" not in resp.headers
+
+
+def test_partial_metabolite_search(app, client):
+    """Expect fuzzy searches running out of time to be flagged, not cached."""
+    budget = app.config["METABOLITE_FUZZY_SEARCH_BUDGET"]
+    app.config["METABOLITE_FUZZY_SEARCH_BUDGET"] = 0
+    try:
+        for _ in range(2):
+            resp = client.get("/metabolites?query=mnxm1&mode=fuzzy")
+            assert resp.status_code == 200
+            assert resp.headers["X-Search-Partial"] == "true"
+    finally:
+        app.config["METABOLITE_FUZZY_SEARCH_BUDGET"] = budget
+    resp = client.get("/metabolites?query=mnxm1&mode=fuzzy")
+    assert "X-Search-Partial" not in resp.headers
+
+
+def test_reaction_search_truncation(client):
+    """Expect only rankings leaving out matches to be flagged as truncated."""
+    resp = client.get("/reactions?query=glucose")
+    assert resp.headers["X-Search-Truncated"] == "true"
+    # No reaction matches the query, so the ranking leaves none out.
+    resp = client.get("/reactions?query=~")
+    assert resp.status_code == 200
+    assert "X-Search-Truncated" not in resp.headers
+
+
+def test_pagination(client, monkeypatch):
+    """Expect the pages to follow each other, ranking the query only once."""
+    expected = client.get("/metabolites?query=mnxm1&limit=100").get_json()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Searched for a cached query.")
+
+    monkeypatch.setattr(search, "search_metabolites", fail)
+    results = []
+    params = {"query": "MNXM1", "limit": 25}
+    for _ in range(4):
+        resp = client.get("/metabolites", query_string=params)
+        assert resp.status_code == 200
+        assert resp.headers["X-Total-Count"]
+        results.extend(resp.get_json())
+        params["cursor"] = resp.headers["X-Next-Cursor"]
+    assert results == expected
+    resp = client.get("/reactions?query=glucose&limit=10")
+    assert len(resp.get_json()) == 10
+    assert resp.headers["X-Total-Count"] == "200"
+    assert resp.headers["X-Search-Truncated"] == "true"
+    resp = client.get(
+        f"/reactions?query=glucose&cursor={resp.headers['X-Next-Cursor']}"
+    )
+    assert len(resp.get_json()) == 30
+    resp = client.get("/reactions?query=glucose&cursor=invalid")
+    assert resp.status_code == 422
+
+
+def test_batch_cache(client):
+    before = client.get("/stats").get_json()["caches"]["metabolites_batch"]
+    for _ in range(2):
+        resp = client.get("/metabolites/batch?query=MNXM1,unknown")
+        assert resp.status_code == 200
+        assert not resp.get_json()[1]
+    after = client.get("/stats").get_json()["caches"]["metabolites_batch"]
+    assert after["hits"] >= before["hits"] + 1
+    flights = client.get("/stats").get_json()["flights"]
+    assert flights["metabolites_batch"]["computed"] >= 1
+
+
+def test_batch_cache_keys(client):
+    """Expect cached lookups to be shared only by equivalent queries."""
+    identifier = next(
+        identifier
+        for namespace, identifier in data.metabolite_namespace_index
+        if namespace == "bigg.metabolite" and identifier != identifier.upper()
+    )
+    indexes = (data.metabolite_key_index, data.metabolite_namespace_index)
+    before = client.get("/stats").get_json()["caches"]["metabolites_batch"]
+    for query in (
+        f"MNXM1,bigg.metabolite:{identifier}",
+        f"mnxm1,BIGG.Metabolite:{identifier}",
+        f"mnxm1,bigg.metabolite:{identifier.upper()}",
+    ):
+        resp = client.get(f"/metabolites/batch?query={query}")
+        assert [m.get("mnx_id") for m in resp.get_json()] == [
+            resources._lookup_id(*indexes, q) for q in query.split(",")
+        ]
+    after = client.get("/stats").get_json()["caches"]["metabolites_batch"]
+    assert after["hits"] == before["hits"] + 1
+
+
+def test_rendered_like_schemas(client):
+    """Expect the rendered fragments to equal the marshalled objects."""
+    reactions = list(data.reactions.values())[:50]
+    query = ",".join(r.mnx_id for r in reactions) + ",unknown"
+    for _ in range(2):
+        resp = client.get(f"/reactions/batch?query={query}")
+        assert resp.get_json() == ReactionResponseSchema(many=True).dump(
+            [r.with_references() for r in reactions] + [None]
+        )
+    metabolite = next(iter(data.metabolites.values()))
+    resp = client.get(f"/metabolites/batch?query={metabolite.mnx_id}")
+    assert resp.get_json() == [MetaboliteSchema().dump(metabolite)]
+
+
+def test_streamed_batch(client):
+    """Expect one line of JSON per query, as selected by format or Accept."""
+    query = "MNXM1,unknown,MNXM2"
+    expected = client.get(f"/metabolites/batch?query={query}").get_json()
+    for url, headers in (
+        (f"/metabolites/batch?query={query}&format=ndjson", {}),
+        (
+            f"/metabolites/batch?query={query}",
+            {"Accept": "application/x-ndjson"},
+        ),
+    ):
+        resp = client.get(url, headers=headers)
+        assert resp.status_code == 200
+        assert resp.mimetype == "application/x-ndjson"
+        assert [json.loads(line) for line in resp.data.splitlines()] == expected
+    resp = client.get("/reactions/batch?query=unknown&format=ndjson")
+    assert resp.data == b"{}\n"
+
+
+def test_posted_batch(client):
+    """Expect posted batches, also compressed, to return results in order."""
+    query = ["MNXM1", "unknown", "mnxm2", "MNXM1"]
+    expected = client.get(f"/metabolites/batch?query={','.join(query)}")
+    body = json.dumps({"query": query}).encode()
+    for data_, headers in (
+        (body, {}),
+        (gzip.compress(body), {"Content-Encoding": "gzip"}),
+    ):
+        resp = client.post(
+            "/metabolites/batch",
+            data=data_,
+            content_type="application/json",
+            headers=headers,
+        )
+        assert resp.status_code == 200
+        assert resp.get_json() == expected.get_json()
+    resp = client.post(
+        "/reactions/batch",
+        data=b"invalid",
+        content_type="application/json",
+        headers={"Content-Encoding": "gzip"},
+    )
+    assert resp.status_code == 400
+
+
+def test_posted_batch_lookups(client, monkeypatch):
+    """Expect queries differing only in case to be looked up once."""
+    lookups = []
+
+    def lookup(*args):
+        lookups.append(args[-1])
+        return lookup_id(*args)
+
+    lookup_id = resources._lookup_id
+    monkeypatch.setattr(resources, "_lookup_id", lookup)
+    resp = client.post(
+        "/metabolites/batch", json={"query": ["MNXM1", "mnxm1", "Mnxm1"]}
+    )
+    assert [m["mnx_id"] for m in resp.get_json()] == ["MNXM1"] * 3
+    assert len(lookups) == 1
+
+
+def test_namespaced_batch(client):
+    """Expect namespace-qualified queries to match exactly that identifier."""
+    (namespace, identifier), metabolite = next(
+        (key, metabolite)
+        for key, metabolite in data.metabolite_namespace_index.items()
+        if key[0] == "bigg.metabolite"
+    )
+    query = (
+        f"{namespace}:{identifier},metanetx.chemical:{metabolite.mnx_id},"
+        "bigg.metabolite:unknown"
+    )
+    resp = client.get(f"/metabolites/batch?query={query}")
+    assert [m.get("mnx_id") for m in resp.get_json()] == [
+        metabolite.mnx_id,
+        metabolite.mnx_id,
+        None,
+    ]
+    (namespace, identifier), reaction = next(
+        iter(data.reaction_namespace_index.items())
+    )
+    resp = client.post(
+        "/reactions/batch", json={"query": [f"{namespace}:{identifier}"]}
+    )
+    assert resp.get_json()[0]["reaction"]["mnx_id"] == reaction.mnx_id
+    # Unqualified identifiers containing a colon are still found.
+    identifier = next(
+        identifier
+        for namespace, identifier in data.metabolite_namespace_index
+        if namespace == "chebi"
+    )
+    resp = client.get(f"/metabolites/batch?query={identifier}")
+    assert (
+        resp.get_json()[0]["mnx_id"]
+        == data.metabolite_key_index[identifier.lower()].mnx_id
+    )
+
+
+def test_translation(client):
+    """Expect identifiers translated through the annotations, in order."""
+    metabolite = next(
+        metabolite
+        for metabolite in data.metabolites.values()
+        if {"bigg.metabolite", "kegg.compound"} <= metabolite.annotation.keys()
+    )
+    identifier = metabolite.annotation["bigg.metabolite"][0]
+    query = [identifier, "unknown", identifier]
+    params = {"source": "bigg.metabolite", "target": "kegg.compound"}
+    resp = client.get(
+        "/metabolites/translate",
+        query_string=dict(params, query=",".join(query)),
+    )
+    assert resp.status_code == 200
+    expected = metabolite.annotation["kegg.compound"]
+    assert resp.get_json() == dict(
+        params, translations=[expected, None, expected]
+    )
+    resp_ = client.post(
+        "/metabolites/translate", json=dict(params, query=query)
+    )
+    assert resp_.get_json() == resp.get_json()
+    reaction = next(iter(data.reactions.values()))
+    resp = client.post(
+        "/reactions/translate",
+        json={
+            "source": "metanetx.reaction",
+            "target": "metanetx.reaction",
+            "query": [reaction.mnx_id],
+        },
+    )
+    assert resp.get_json()["translations"][0][0] == reaction.mnx_id
+
+
+def test_translation_namespaces(client):
+    """Expect unknown namespaces to be rejected rather than translated."""
+    for index, known in (
+        (data.reaction_namespace_index, namespaces.REACTION_NAMESPACES),
+        (data.metabolite_namespace_index, namespaces.METABOLITE_NAMESPACES),
+    ):
+        assert {namespace for namespace, _ in index} <= known
+    resp = client.get(
+        "/metabolites/translate",
+        query_string={
+            "source": "BIGG.Metabolite",
+            "target": "bigg.reaction",
+            "query": "glc__D",
+        },
+    )
+    assert resp.status_code == 422
+    assert resp.get_json().keys() == {"target"}
+    resp = client.post(
+        "/reactions/translate",
+        json={"source": "unknown", "target": "rhea", "query": ["R1"]},
+    )
+    assert resp.status_code == 422
+    assert resp.get_json().keys() == {"source"}
+
+
+def test_normalized_batch(client):
+    """Expect the references once, in lookup tables keyed by ID."""
+    reactions = list(data.reactions.values())[:50]
+    query = ",".join(r.mnx_id for r in reactions) + ",unknown"
+    resp = client.get(f"/reactions/batch?query={query}&normalize=true")
+    assert resp.status_code == 200
+    metabolites = {}
+    compartments = {}
+    for reaction in reactions:
+        references = reaction.with_references()
+        metabolites.update((m.mnx_id, m) for m in references["metabolites"])
+        compartments.update((c.mnx_id, c) for c in references["compartments"])
+    assert resp.get_json() == NormalizedReactionResponseSchema().dump(
+        {
+            "reactions": reactions + [None],
+            "metabolites": metabolites,
+            "compartments": compartments,
+        }
+    )
+    resp = client.get(
+        f"/reactions/batch?query={query}&normalize=true&format=ndjson"
+    )
+    assert resp.status_code == 422
+
+
+def test_nested_fieldsets(client):
+    """Expect different nested fields of the same object rendered apart."""
+    reaction = next(iter(data.reactions.values()))
+    for field in ("name", "ec", "name"):
+        resp = client.get(
+            f"/reactions/batch?query={reaction.mnx_id}&fields=reaction.{field}"
+        )
+        assert resp.get_json() == [
+            {"reaction": {field: getattr(reaction, field)}}
+        ]
+
+
+def test_sparse_fieldsets(client, monkeypatch):
+    """Expect only the requested fields, without accessing the others."""
+    reactions = list(data.reactions.values())[:5]
+    query = ",".join(r.mnx_id for r in reactions)
+    only = ("reaction.name", "metabolites.mnx_id")
+    resp = client.get(f"/reactions/batch?query={query}&fields={','.join(only)}")
+    assert resp.get_json() == ReactionResponseSchema(many=True, only=only).dump(
+        [r.with_references() for r in reactions]
+    )
+
+    def fail(*args):
+        raise AssertionError("Accessed an unrequested field.")
+
+    monkeypatch.setattr(data.BaseReaction, "with_references", fail)
+    monkeypatch.setattr(data.BaseReaction, "equation_parsed", property(fail))
+    resp = client.get(f"/reactions/batch?query={query}&fields=reaction.mnx_id")
+    assert resp.get_json() == [
+        {"reaction": {"mnx_id": r.mnx_id}} for r in reactions
+    ]
+    resp = client.get(
+        f"/reactions/batch?query={query}&fields=reaction.ec&normalize=true"
+    )
+    assert resp.get_json() == {"reactions": [{"ec": r.ec} for r in reactions]}
+    resp = client.get("/metabolites?query=MNXM1&fields=name")
+    assert all(result.keys() == {"name"} for result in resp.get_json())
+    resp = client.get("/metabolites?query=MNXM1&fields=equation")
+    assert resp.status_code == 422
+
+
+def test_snapshot(app, tmp_path):
+    path = str(tmp_path / "snapshot.pickle")
+    parser.write_snapshot(path)
+    counts = (len(data.reactions), len(data.metabolites))
+    reaction = next(iter(data.reactions.values()))
+    parser.load_metanetx_data(snapshot=path)
+    assert (len(data.reactions), len(data.metabolites)) == counts
+    restored = data.reactions[reaction.mnx_id]
+    assert restored is not reaction
+    assert restored.equation_parsed == reaction.equation_parsed
+    assert data.reaction_key_index[reaction.mnx_id.lower()] is restored
+    assert data.reaction_ngram_index.shortlist(reaction.mnx_id, 1) == [restored]
+
+
+def test_staged_loading(client, monkeypatch):
+    """Expect lookups to be served while the search indexes are built."""
+    monkeypatch.setattr(parser, "loaded", set())
+    resp = client.get("/healthz")
+    assert resp.status_code == 503
+    assert resp.get_json() == {"stages": {"lookups": False, "search": False}}
+    assert client.get("/reactions/batch?query=MNXR1").status_code == 503
+    assert client.get("/healthz/live").status_code == 200
+
+    indexing = threading.Event()
+    indexed = threading.Event()
+    index_reactions = parser._index_reactions
+
+    def wait_and_index(reactions):
+        indexing.set()
+        indexed.wait()
+        return index_reactions(reactions)
+
+    monkeypatch.setattr(parser, "_index_reactions", wait_and_index)
+    parser.start_loading()
+    try:
+        indexing.wait()
+        resp = client.get("/healthz")
+        assert resp.status_code == 200
+        assert resp.get_json() == {"stages": {"lookups": True, "search": False}}
+        assert client.get("/reactions/batch?query=MNXR1").status_code == 200
+        assert client.get("/reactions?query=MNXR1").status_code == 503
+    finally:
+        indexed.set()
+        parser.wait_until_loaded()
+    assert parser.failure is None
+    assert client.get("/reactions?query=MNXR1").status_code == 200
+
+
+def test_failed_loading(client, monkeypatch):
+    """Expect failing a late stage to fail liveness, unless reloading."""
+    monkeypatch.setattr(data, "_latest", data.current())
+    monkeypatch.setattr(parser, "loaded", set())
+    monkeypatch.setattr(parser, "failure", None)
+
+    def fail(reactions):
+        raise RuntimeError("Failed to index.")
+
+    monkeypatch.setattr(parser, "_index_reactions", fail)
+    parser.start_loading()
+    parser.wait_until_loaded()
+    assert parser.loaded == {"lookups"}
+    assert isinstance(parser.failure, RuntimeError)
+    assert client.get("/healthz/live").status_code == 500
+    monkeypatch.setattr(parser, "loaded", set(parser.STAGES))
+    monkeypatch.setattr(parser, "failure", None)
+    parser.start_loading()
+    parser.wait_until_loaded()
+    assert parser.failure is None
+    assert client.get("/healthz/live").status_code == 200
+
+
+def test_reload(app, client, monkeypatch):
+    """Expect a new release to be swapped in, with its own version."""
+    monkeypatch.setattr(data, "_latest", data.current())
+    resp = client.get("/metabolites/batch?query=MNXM1")
+    version = resp.headers["X-Dataset-Version"]
+    monkeypatch.setattr(parser, "_checksum", lambda: "0" * 64)
+    assert parser.reload()
+    assert not parser.reload()
+    parser.wait_until_loaded()
+    resp_ = client.get("/metabolites/batch?query=MNXM1")
+    assert resp_.headers["X-Dataset-Version"] == "0" * 16 != version
+    assert resp_.get_json() == resp.get_json()
+
+
+def test_admin_reload(app, monkeypatch):
+    monkeypatch.setitem(app.config, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(parser, "reload", lambda: True)
+    headers = {"Authorization": "Bearer secret"}
+    with app.test_request_context(method="POST", headers=headers):
+        assert resources.reload_dataset().status_code == 202
+    with app.test_request_context(method="POST", headers={}):
+        with pytest.raises(Forbidden):
+            resources.reload_dataset()
+    monkeypatch.setattr(parser, "reload", lambda: False)
+    with app.test_request_context(method="POST", headers=headers):
+        with pytest.raises(Conflict):
+            resources.reload_dataset()
+
+
+def test_parallel_parsing(app):
+    """Expect parsing in several processes to load an identical data store."""
+    objects = parser._parse_metanetx_data(processes=3)
+    assert sorted(objects) == sorted(parser.SNAPSHOT_OBJECTS)
+    for name, parsed in objects.items():
+        assert _comparable(parsed) == _comparable(getattr(data, name)), name
+
+
+def test_lazy_parsing(app, tmp_path):
+    """Expect lazy objects to materialize as the loaded ones."""
+    objects = parser._parse_metanetx_data(lazy=True, sidecar_directory=tmp_path)
+    for name in ("reactions", "metabolites"):
+        for mnx_id, obj in getattr(data, name).items():
+            lazy_obj = objects[name][mnx_id]
+            assert lazy_obj.annotation == obj.annotation
+            assert lazy_obj.name == obj.name
+    for mnx_id, reaction in data.reactions.items():
+        lazy_reaction = objects["reactions"][mnx_id]
+        assert lazy_reaction.equation_parsed == reaction.equation_parsed
+    for name in (
+        "reaction_key_index",
+        "metabolite_key_index",
+        "reaction_namespace_index",
+        "metabolite_namespace_index",
+    ):
+        assert {key: obj.mnx_id for key, obj in objects[name].items()} == {
+            key: obj.mnx_id for key, obj in getattr(data, name).items()
+        }
+    for name, _ in INDEXES:
+        assert _comparable(objects[name]) == _comparable(getattr(data, name))
+
+
+def _comparable(obj):
+    """Return the contents of a data store object with entries as IDs."""
+    if isinstance(obj, dict):
+        return [(key, _comparable(value)) for key, value in obj.items()]
+    if hasattr(obj, "mnx_id"):
+        return {slot: getattr(obj, slot) for slot in obj.__slots__}
+    attributes = dict(vars(obj))
+    # The sorted n-grams are only computed on searching.
+    attributes.pop("_sorted_grams", None)
+    attributes["entries"] = [entry.mnx_id for entry in obj.entries]
+    return attributes
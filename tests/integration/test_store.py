@@ -0,0 +1,118 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the packed, read-only data store."""
+
+import copy
+import gc
+import os
+
+import pytest
+
+from metanetx import data, search, store
+
+
+@pytest.fixture
+def packed(app, tmp_path, monkeypatch):
+    """Serve the data store from a packed store for the test's duration."""
+    monkeypatch.setattr(data, "_latest", data.current())
+    path = str(tmp_path / "store")
+    store.write_store(path, "checksum", data.current())
+    assert store.open_store(path, "outdated") is None
+    return store.open_store(path, "checksum")
+
+
+def _install(packed):
+    dataset = copy.copy(data.current())
+    store.install(packed, dataset)
+    data.swap(dataset)
+
+
+def test_packed_store(packed):
+    """Expect the packed store to hold the same data as the Python objects."""
+    reactions = dict(data.reactions)
+    metabolite_key_index = dict(data.metabolite_key_index)
+    reaction_namespace_index = dict(data.reaction_namespace_index)
+    expected, _ = search.search_reactions("pyruvate kinase", 30)
+    _install(packed)
+    assert list(data.reactions) == list(reactions)
+    for mnx_id, reaction in list(reactions.items())[::100]:
+        packed_reaction = data.reactions[mnx_id]
+        for attribute in ("name", "equation_parsed", "ec", "annotation"):
+            assert getattr(packed_reaction, attribute) == getattr(
+                reaction, attribute
+            )
+    for key, metabolite in list(metabolite_key_index.items())[::100]:
+        assert data.metabolite_key_index[key].mnx_id == metabolite.mnx_id
+    assert "unknown" not in data.reaction_key_index
+    for key, reaction in list(reaction_namespace_index.items())[::100]:
+        assert data.reaction_namespace_index[key].mnx_id == reaction.mnx_id
+    assert list(data.reaction_namespace_index) == sorted(
+        reaction_namespace_index, key=lambda key: ":".join(key)
+    )
+    assert ("metanetx.reaction", "unknown") not in data.reaction_namespace_index
+    results, _ = search.search_reactions("pyruvate kinase", 30)
+    assert [r.mnx_id for r in results] == [r.mnx_id for r in expected]
+
+
+@pytest.mark.skipif(
+    not os.path.exists("/proc/self/smaps_rollup"), reason="Requires Linux."
+)
+def test_owned_memory_after_fork(packed):
+    """Expect workers reading the packed store to copy far less memory."""
+    owned_by_objects = _owned_after_reading()
+    _install(packed)
+    owned_by_store = _owned_after_reading()
+    assert owned_by_store < owned_by_objects / 4
+
+
+def _owned_after_reading():
+    """Return the memory a forked worker owns after reading all data."""
+    # Read everything once before forking, as the first worker to read a page
+    # of the mapped file would otherwise be counted as its only user.
+    _read_all()
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_end)
+            # Like the gunicorn configuration before forking the workers.
+            gc.freeze()
+            before = _private_memory()
+            _read_all()
+            os.write(write_end, str(_private_memory() - before).encode())
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as file_:
+        owned = int(file_.read())
+    os.waitpid(pid, 0)
+    return owned
+
+
+def _read_all():
+    for reaction in data.reactions.values():
+        reaction.name, reaction.annotation, reaction.equation_parsed
+    for metabolite in data.metabolites.values():
+        metabolite.name, metabolite.annotation
+
+
+def _private_memory():
+    """Return the bytes of memory written to by this process only."""
+    # Clean pages of the mapped file are in the page cache, and not owned.
+    with open("/proc/self/smaps_rollup") as file_:
+        for line in file_:
+            if line.startswith("Private_Dirty:"):
+                return 1024 * int(line.split()[1])
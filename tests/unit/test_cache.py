@@ -0,0 +1,171 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the search result caches."""
+
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from metanetx.cache import MISSING, LRUCache, SharedCache, SingleFlight
+
+
+def test_lru_eviction():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", None)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {
+        "size": 2,
+        "maxsize": 2,
+        "hits": 3,
+        "misses": 1,
+        "evictions": 1,
+    }
+
+
+def test_disabled():
+    cache = LRUCache(0)
+    cache.set("a", 1)
+    assert cache.get("a") is MISSING
+    assert len(cache) == 0
+
+
+def test_shared_eviction(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache"), 2, ways=2)
+    cache.set(["a"], ["MNXM1"])
+    cache.set("b", None)
+    assert cache.get(["a"]) == ["MNXM1"]
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    assert cache.get(["a"]) == ["MNXM1"]
+    assert cache.stats() == {
+        "size": 2,
+        "maxsize": 2,
+        "hits": 2,
+        "misses": 1,
+        "evictions": 1,
+    }
+
+
+def _use_shared_cache(path, worker):
+    cache = SharedCache(path, 64)
+    for i in range(200):
+        key = f"query-{(i * (worker + 1)) % 100}"
+        value = cache.get(key)
+        assert value is MISSING or value == [key, 30]
+        cache.set(key, [key, 30])
+
+
+def test_shared_between_processes(tmp_path):
+    """Expect consistent entries when several processes use one cache."""
+    path = str(tmp_path / "cache")
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=_use_shared_cache, args=(path, worker))
+        for worker in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    cache = SharedCache(path, 64)
+    stats = cache.stats()
+    assert stats["hits"] + stats["misses"] == 800
+    assert stats["hits"] > 0
+    assert 0 < stats["size"] <= 64
+    assert cache.get("query-0") in (MISSING, ["query-0", 30])
+
+
+def test_single_flight():
+    """Expect concurrent callers to share the result of one computation."""
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    computations = []
+
+    def compute():
+        computations.append(1)
+        started.set()
+        release.wait()
+        return ["MNXR1"]
+
+    results = []
+
+    def call():
+        results.append(flight.run("a", compute))
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    while flight.coalesced < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [["MNXR1"]] * 4
+    assert len(computations) == 1
+    assert flight.stats() == {"in_flight": 0, "computed": 1, "coalesced": 3}
+
+    def fail():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        flight.run("a", fail)
+    assert flight.run("a", lambda: 1) == 1
+
+
+def test_single_flight_interrupted():
+    """Expect callers to compute anew once the computing one is interrupted."""
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    class Interrupt(BaseException):
+        pass
+
+    def interrupted():
+        started.set()
+        release.wait()
+        raise Interrupt()
+
+    def lead():
+        with pytest.raises(Interrupt):
+            flight.run("a", interrupted)
+
+    results = []
+    leader = threading.Thread(target=lead)
+    follower = threading.Thread(
+        target=lambda: results.append(flight.run("a", lambda: ["MNXR1"]))
+    )
+    leader.start()
+    started.wait()
+    follower.start()
+    while flight.coalesced < 1:
+        time.sleep(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    assert results == [["MNXR1"]]
+    assert flight.stats() == {"in_flight": 0, "computed": 2, "coalesced": 0}
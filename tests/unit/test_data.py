@@ -0,0 +1,96 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the compact data classes and datasets."""
+
+import pickle
+
+import pytest
+from greenlet import getcurrent, greenlet
+
+from metanetx import data
+from metanetx.data import Dataset, Metabolite, Reaction
+
+
+def test_reaction_equation():
+    """Expect the compact equation to unpack into the parsed equation."""
+    equation = "1 MNXM1@MNXD1 + 2.5 MNXM2@MNXD1 = 1 MNXM3@MNXD2"
+    reaction = Reaction("MNXR1", "Reaction", equation, "")
+    assert reaction.equation_parsed == Reaction.parse_equation(equation)
+    assert not hasattr(reaction, "__dict__")
+
+
+def test_shared_identifiers():
+    """Expect equations to share the metabolite and compartment IDs."""
+    metabolite = Metabolite("".join(["MNXM", "1"]), "Metabolite", "")
+    first = Reaction("MNXR1", None, "1 MNXM1@MNXD1 = 1 MNXM1@MNXD2", "")
+    second = Reaction("MNXR2", None, "2 MNXM1@MNXD2 = 1 MNXM2@MNXD2", "")
+    assert first._species[0] is metabolite.mnx_id
+    assert second._species[0] is metabolite.mnx_id
+    assert first._species[3] is second._species[1]
+
+
+def test_pickle():
+    equation = "1 MNXM1@MNXD1 = 1 MNXM2@MNXD1"
+    reaction = Reaction("MNXR1", "Reaction", equation, "")
+    reaction.annotation["bigg.reaction"] = ["R1"]
+    restored = pickle.loads(pickle.dumps(reaction, pickle.HIGHEST_PROTOCOL))
+    assert restored.equation_parsed == reaction.equation_parsed
+    assert restored.annotation == {"bigg.reaction": ["R1"]}
+
+
+def test_invalid_equation():
+    with pytest.raises(ValueError):
+        Reaction("MNXR1", None, "(n) MNXM1@MNXD1 = 1 MNXM2@MNXD1", "")
+
+
+def test_pinned_dataset(monkeypatch):
+    """Expect pinned requests to keep their dataset across swaps."""
+    monkeypatch.setattr(data, "_latest", Dataset("old"))
+    old = data.current()
+    data.pin()
+    try:
+        data.swap(Dataset("new", reactions={"MNXR1": None}))
+        assert data.current() is old
+        assert data.reactions == {}
+    finally:
+        data.unpin()
+    assert data.current().version == "new"
+    assert list(data.reactions) == ["MNXR1"]
+    with pytest.raises(ValueError):
+        Dataset(unknown={})
+
+
+def test_interleaved_pins(monkeypatch):
+    """Expect concurrent requests to keep their own pins across a swap."""
+    monkeypatch.setattr(data, "_latest", Dataset("old"))
+    versions = []
+
+    def request():
+        data.pin()
+        main.switch()
+        versions.append(data.current().version)
+        data.unpin()
+
+    main = getcurrent()
+    first, second = greenlet(request), greenlet(request)
+    first.switch()
+    data.swap(Dataset("new"))
+    second.switch()
+    # The second request finishes and unpins before the first one.
+    second.switch()
+    first.switch()
+    assert versions == ["new", "old"]
+    assert data.current().version == "new"
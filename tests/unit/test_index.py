@@ -0,0 +1,103 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the search indexes."""
+
+import itertools
+import string
+
+from metanetx.index import Deadline, DeletionIndex, NgramIndex, SubstringIndex
+
+
+def test_ngrams():
+    index = NgramIndex(3)
+    assert index.ngrams("ATPase") == {"atp", "tpa", "pas", "ase"}
+    assert index.ngrams("H+") == {"h+"}
+    assert index.ngrams("") == set()
+
+
+def test_shortlist_order():
+    """Expect the best overlapping entries, in insertion order."""
+    index = NgramIndex(3)
+    index.add("a", ["hexokinase", None])
+    index.add("b", ["pyruvate kinase", "PYK"])
+    index.add("c", ["pyruvate dehydrogenase"])
+    assert index.shortlist("pyruvate kinase", 2) == ["b", "c"]
+    assert index.shortlist("kin", 5) == ["a", "b"]
+    assert index.shortlist("xyz", 5) == []
+
+
+def test_substring_find():
+    """Expect the same results as a case-insensitive substring scan."""
+    keys = [["MNXM1", "H(+)"], ["MNXM2", "H2O"], ["MNXM41", "D-glucose"]]
+    index = SubstringIndex()
+    for entry, entry_keys in enumerate(keys):
+        index.add(entry, entry_keys)
+    for query in ("", "h", "O", "(+", "mnxm", "MNXM4", "glucose", "x", "\0"):
+        expected = [
+            entry
+            for entry, entry_keys in enumerate(keys)
+            if any(query.lower() in key.lower() for key in entry_keys)
+        ]
+        assert index.find(query, 3) == (expected, len(expected))
+        entries, total = index.find(query, 1)
+        assert entries == expected[:1]
+        assert (total > 1) == (len(expected) > 1)
+    # Keys are searched individually.
+    assert index.find("+)mnxm2", 3) == ([], 0)
+
+
+def test_substring_find_estimate():
+    """Expect the total beyond the limit to be estimated."""
+    index = SubstringIndex()
+    for entry in range(1000):
+        index.add(entry, [f"MNXM{entry}", "glucose" if entry % 4 else "gluc"])
+    entries, total = index.find("glucose", 10)
+    assert entries == [entry for entry in range(14) if entry % 4][:10]
+    assert 700 <= total <= 800
+    entries, total = index.find("glu", 10)
+    assert entries == list(range(10))
+    assert total == 1000
+
+
+def test_deletion_find():
+    """Expect typos to be tolerated, and exact names to rank first."""
+    index = DeletionIndex()
+    index.add("MNXM41", ["MNXM41", "D-glucose"])
+    index.add("MNXM7381", ["MNXM7381", "glucose"])
+    index.add("MNXM2", ["MNXM2", "H2O"])
+    assert index.find("glucose", 5) == (["MNXM7381", "MNXM41"], 2)
+    assert index.find("glcose", 5) == (["MNXM7381", "MNXM41"], 2)
+    assert index.find("d-glucsoe", 5) == (["MNXM41"], 1)
+    assert index.find("h20", 5) == (["MNXM2"], 1)
+    assert index.find("mnxm41", 1) == (["MNXM41"], 2)
+    assert index.find("", 5) == ([], 0)
+
+
+def test_deletion_find_deadline():
+    """Expect expired deadlines to stop verifying candidates, and be flagged."""
+    index = DeletionIndex()
+    letters = string.ascii_lowercase
+    for first, second in itertools.product(letters, letters):
+        index.add(first + second, [f"gluco{first}{second}"])
+    deadline = Deadline()
+    entries, total = index.find("glucose", 10, deadline)
+    assert entries[0] == "se"
+    assert total == len(index)
+    assert not deadline.expired
+    deadline = Deadline(0)
+    entries, total = index.find("glucose", 10, deadline)
+    assert total == index.chunk_size
+    assert deadline.expired
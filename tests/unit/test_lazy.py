@@ -0,0 +1,91 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the lazily parsed reactions and metabolites."""
+
+import pytest
+
+from metanetx import lazy
+from metanetx.data import BaseMetabolite, Metabolite, Reaction
+from metanetx.lazy import LazyMetabolite, LazyReaction, Sidecar
+
+
+@pytest.fixture
+def sidecar(monkeypatch, tmp_path):
+    monkeypatch.setattr(lazy.materialized, "maxsize", 16)
+    return Sidecar(tmp_path)
+
+
+def test_lazy_reaction(sidecar):
+    """Expect lazy reactions to materialize like eager ones."""
+    equation = "1 MNXM1@MNXD1 + 2.5 MNXM2@MNXD1 = .5 MNXM3@MNXD2"
+    eager = Reaction("MNXR1", "Reaction", equation, "1.1.1.1")
+    reaction = LazyReaction("MNXR1", "Reaction", equation, "1.1.1.1", sidecar)
+    other = LazyReaction("MNXR2", None, equation, "", sidecar)
+    for obj in (eager, reaction):
+        obj.annotate("bigg.reaction", "R1")
+        obj.annotate("rhea", "10000")
+        obj.annotate("bigg.reaction", "R_R1")
+    other.annotate("rhea", "20000")
+    sidecar.flush()
+    assert reaction.annotation == eager.annotation
+    assert reaction.equation_parsed == eager.equation_parsed
+    assert reaction.references() == eager.references()
+    assert other.annotation == {"rhea": ["20000"]}
+    assert list(lazy.annotations([eager, reaction, other])) == [
+        eager.annotation,
+        eager.annotation,
+        other.annotation,
+    ]
+
+
+def test_lazy_metabolite(sidecar):
+    metabolite = LazyMetabolite("MNXM1", "Metabolite", "H2O", sidecar)
+    assert metabolite.annotation == {}
+    metabolite.annotate("chebi", "CHEBI:" + "x" * 1000)
+    sidecar.flush()
+    assert metabolite.annotation == {"chebi": ["CHEBI:" + "x" * 1000]}
+    assert metabolite.match("metab")
+    assert isinstance(metabolite, BaseMetabolite)
+
+
+@pytest.mark.parametrize(
+    "cls, eager", [(LazyReaction, Reaction), (LazyMetabolite, Metabolite)]
+)
+def test_lazy_slots(cls, eager):
+    """Expect lazy objects to allocate no slots for lazily parsed attributes."""
+    slots = {
+        slot for base in cls.__mro__ for slot in getattr(base, "__slots__", ())
+    }
+    parsed = {"annotation", "_species", "_coefficients"}
+    sidecar = {"_sidecar", "_annotation_end"}
+    assert slots == set(eager.__slots__) - parsed | sidecar
+
+
+@pytest.mark.parametrize(
+    "equation",
+    [
+        "(n) MNXM1@MNXD1 = 1 MNXM2@MNXD1",
+        "1.2.3 MNXM1@MNXD1 = 1 MNXM2@MNXD1",
+        "1 MNXM1@MNXD1 = 1 MNXM2@MNXD1 = 1 MNXM3@MNXD1",
+        " = 1 MNXM2@MNXD1",
+    ],
+)
+def test_invalid_lazy_equation(sidecar, equation):
+    """Expect lazy reactions to reject the equations eager ones do."""
+    with pytest.raises(ValueError):
+        Reaction("MNXR1", None, equation, "")
+    with pytest.raises(ValueError):
+        LazyReaction("MNXR1", None, equation, "", sidecar)
@@ -0,0 +1,79 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the WSGI middleware."""
+
+import gzip
+import io
+
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from metanetx.middleware import GzipRequest
+
+
+def _echo(environ, start_response):
+    start_response("200 OK", [])
+    return [environ["wsgi.input"].read(int(environ["CONTENT_LENGTH"]))]
+
+
+def _post(
+    body, max_size=100, headers=(("Content-Encoding", "gzip"),), **environ
+):
+    builder = EnvironBuilder(method="POST", data=body, headers=list(headers))
+    environ = dict(builder.get_environ(), **environ)
+    body, status, _ = run_wsgi_app(GzipRequest(_echo, max_size), environ)
+    return int(status.split()[0]), b"".join(body)
+
+
+def test_gzip_request():
+    assert _post(gzip.compress(b"batch")) == (200, b"batch")
+    assert _post(b"invalid")[0] == 400
+
+
+def test_gzip_request_limits():
+    """Expect 413 for bodies too large before or after decompressing."""
+    assert _post(gzip.compress(bytes(101)))[0] == 413
+    assert _post(gzip.compress(bytes(100)))[0] == 200
+    assert _post(gzip.compress(bytes(range(256))), max_size=200)[0] == 413
+
+
+def test_truncated_gzip_request():
+    """Expect 400 for gzip streams without their trailer."""
+    assert _post(gzip.compress(b"batch")[:-8])[0] == 400
+
+
+def test_chunked_gzip_request():
+    """Expect bodies without a length read only from terminated input."""
+    body = gzip.compress(b"batch")
+    chunked = {"CONTENT_LENGTH": "", "wsgi.input": io.BytesIO(body)}
+    assert _post(body, **chunked)[0] == 411
+    chunked["wsgi.input"] = io.BytesIO(body)
+    assert _post(body, **chunked, **{"wsgi.input_terminated": True}) == (
+        200,
+        b"batch",
+    )
+
+
+def test_plain_request_limits():
+    """Expect the limit to apply to bodies which aren't compressed too."""
+    assert _post(bytes(100), headers=()) == (200, bytes(100))
+    assert _post(bytes(101), headers=())[0] == 413
+    chunked = {
+        "CONTENT_LENGTH": "",
+        "wsgi.input": io.BytesIO(bytes(101)),
+        "wsgi.input_terminated": True,
+    }
+    assert _post(bytes(101), headers=(), **chunked)[0] == 413
+    assert _post(b"batch", headers=(), CONTENT_LENGTH="-1")[0] == 400
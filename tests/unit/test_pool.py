@@ -0,0 +1,91 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the search pool."""
+
+import operator
+import os
+import signal
+import time
+
+import pytest
+
+from metanetx import pool as search_pool
+from metanetx.pool import SearchPool
+
+
+def test_run():
+    """Expect results and exceptions of the functions run in the processes."""
+    pool = SearchPool(2)
+    pool.start()
+    try:
+        assert pool.run(operator.add, 1, 2) == 3
+        assert pool.run(os.getpid) != os.getpid()
+        with pytest.raises(ZeroDivisionError):
+            pool.run(operator.truediv, 1, 0)
+        assert {pool.run(os.getpid) for _ in range(4)} == {
+            pid for pid, _ in pool._children
+        }
+    finally:
+        pool.close()
+
+
+def test_run_unstarted(monkeypatch):
+    """Expect functions to run in this process until the pool is started."""
+    monkeypatch.setattr(search_pool, "pool", SearchPool(2))
+    assert search_pool.run(os.getpid) == os.getpid()
+    assert not search_pool.pool.started
+
+
+class Interrupted(Exception):
+    pass
+
+
+def _child_pids():
+    """Return the IDs of the child processes of this process."""
+    pids = set()
+    for entry in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        if int(fields[1]) == os.getpid():
+            pids.add(int(entry))
+    return pids
+
+
+def test_interrupted():
+    """Expect interrupted searches to stop their process, without forking."""
+
+    def interrupt(*args):
+        raise Interrupted()
+
+    previous = signal.signal(signal.SIGALRM, interrupt)
+    others = _child_pids()
+    pool = SearchPool(2)
+    pool.start()
+    try:
+        for remaining in (1, 0):
+            signal.setitimer(signal.ITIMER_REAL, 0.1)
+            with pytest.raises(Interrupted):
+                pool.run(time.sleep, 10)
+            assert len(pool._children) == remaining
+            assert _child_pids() - others == {pid for pid, _ in pool._children}
+        assert pool.run(os.getpid) == os.getpid()
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+        pool.close()
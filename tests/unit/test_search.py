@@ -0,0 +1,98 @@
+# Copyright (c) 2019, Novo Nordisk Foundation Center for Biosustainability,
+# Technical University of Denmark.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the ranking of search results."""
+
+import time
+
+from metanetx import search
+from metanetx.data import Reaction
+from metanetx.index import Deadline, ScoreTable
+from metanetx.search import top_k
+
+
+def reaction(mnx_id, name, ec="", **annotation):
+    reaction = Reaction(mnx_id, name, "1 MNXM1@MNXD1 = 1 MNXM1@MNXD2", ec)
+    reaction.annotation.update(annotation)
+    return reaction
+
+
+REACTIONS = [
+    reaction("MNXR1", "Pyruvate kinase", "2.7.1.40", bigg=["PYK"]),
+    reaction("MNXR2", "Pyruvate kinase(2)", "2.7.1.40", bigg=["PYK2"]),
+    reaction("MNXR3", None, kegg=["R00200"]),
+    reaction("MNXR4", "Hexokinase", "2.7.1.1", bigg=["HEX1"]),
+    reaction("MNXR5", "Pyruvate kinase(4)", "2.7.1.40", bigg=["PYK4"]),
+    reaction("MNXR10", "", bigg=["PYK"]),
+]
+
+
+def test_top_k_identical_to_sort():
+    """Expect the same order as a full sort, including ties."""
+    for query in ("PYK", "MNXR1", "2.7.1.1", "kinase", "R00200", "", "x"):
+        for k in (0, 1, 2, 3, 6, 10):
+            ranked = sorted(
+                REACTIONS, key=lambda r: r.match(query), reverse=True
+            )
+            matches = sum(r.match(query) > 0 for r in REACTIONS) if k else 0
+            results, found = top_k(REACTIONS, query, k)
+            assert results == ranked[:k]
+            if 0 < k <= len(ranked) and ranked[k - 1].match(query) == 100:
+                # The scan stops once the ranking is known to be truncated.
+                assert min(found, k + 1) == min(matches, k + 1)
+                assert found <= matches
+            else:
+                assert found == matches
+
+
+def test_score_table_matches_reference():
+    """Expect bulk scores to match `Reaction.match`, or exceed it on names."""
+    table = ScoreTable()
+    for r in REACTIONS:
+        identifiers = [i for ids in r.annotation.values() for i in ids]
+        table.add(r, [r.mnx_id, r.ec] + identifiers, r.name)
+    for query in ("PYK", "MNXR1", "2.7.1.1", "kinase", "R00200", "x"):
+        for r, score in zip(REACTIONS, table.scores(query)):
+            if r.name:
+                assert score >= r.match(query)
+            else:
+                assert score == r.match(query)
+
+
+def test_deadline(monkeypatch):
+    """Expect expired searches to rank only the reactions scored so far."""
+    monkeypatch.setattr(search, "CHUNK_SIZE", 2)
+
+    def fail(seconds):
+        raise AssertionError("Slept without gevent.")
+
+    # Checkpoints only sleep to switch greenlets under gevent.
+    monkeypatch.setattr(time, "sleep", fail)
+    deadline = Deadline()
+    assert top_k(REACTIONS, "PYK", 3, deadline) == top_k(REACTIONS, "PYK", 3)
+    assert not deadline.expired
+    deadline = Deadline(0)
+    assert top_k(REACTIONS, "PYK", 3, deadline) == (REACTIONS[:2], 2)
+    assert deadline.expired
+    table = ScoreTable()
+    for r in REACTIONS:
+        table.add(r, [r.mnx_id], r.name)
+    for query in ("PYK", "kinase", "x"):
+        chunked = table.top_k(query, 6, Deadline(), chunk_size=4)
+        assert chunked == table.top_k(query, 6)
+    assert table.top_k("kinase", 6, Deadline(0), chunk_size=4) == (
+        [REACTIONS[i] for i in (0, 1, 3, 2)],
+        3,
+    )